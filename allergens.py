@@ -0,0 +1,230 @@
+import re
+
+# Allergen -> words that indicate it in ingredient text or a user's profile.
+# Covers the EU/UK 14 major allergens; plurals are matched automatically.
+ALLERGEN_TERMS = {
+    "Milk": ["milk", "dairy", "cream", "butter", "buttermilk", "cheese", "whey", "casein", "caseinate",
+             "lactose", "yogurt", "yoghurt", "ghee", "paneer", "curd", "lactalbumin", "milk powder",
+             "cheesecake", "cheeseburger", "milkshake", "buttercream", "butterscotch"],
+    "Eggs": ["egg", "albumen", "albumin", "mayonnaise", "meringue", "ovalbumin", "lysozyme", "eggnog"],
+    "Peanuts": ["peanut", "groundnut", "arachis", "monkey nut"],
+    "Tree nuts": ["nut", "tree nut", "almond", "cashew", "walnut", "hazelnut", "pecan", "pistachio",
+                  "macadamia", "brazil nut", "praline", "marzipan", "pine nut"],
+    "Gluten": ["gluten", "wheat", "barley", "rye", "oat", "spelt", "kamut", "semolina", "durum", "malt",
+               "couscous", "bulgur", "seitan", "farro", "triticale", "einkorn", "emmer"],
+    "Soy": ["soy", "soya", "soybean", "tofu", "edamame", "tempeh", "miso", "soy lecithin"],
+    "Fish": ["fish", "salmon", "tuna", "cod", "anchovy", "anchovies", "sardine", "mackerel", "trout",
+             "haddock", "tilapia", "pollock", "fish sauce", "fishcake", "fishball", "fishfinger"],
+    "Crustaceans": ["crustacean", "shrimp", "prawn", "crab", "lobster", "crayfish", "krill", "shellfish"],
+    "Molluscs": ["mollusc", "mollusk", "mussel", "oyster", "clam", "scallop", "squid", "octopus", "snail"],
+    "Sesame": ["sesame", "tahini", "gingelly"],
+    "Mustard": ["mustard"],
+    "Celery": ["celery", "celeriac"],
+    "Lupin": ["lupin", "lupine"],
+    "Sulphites": ["sulphite", "sulfite", "sulphur dioxide", "sulfur dioxide", "metabisulphite", "metabisulfite"],
+}
+
+# Open Food Facts allergens_tags / traces_tags values.
+ALLERGEN_TAGS = {
+    "en:milk": "Milk", "en:eggs": "Eggs", "en:peanuts": "Peanuts", "en:nuts": "Tree nuts",
+    "en:gluten": "Gluten", "en:soybeans": "Soy", "en:fish": "Fish", "en:crustaceans": "Crustaceans",
+    "en:molluscs": "Molluscs", "en:sesame-seeds": "Sesame", "en:mustard": "Mustard", "en:celery": "Celery",
+    "en:lupin": "Lupin", "en:sulphur-dioxide-and-sulphites": "Sulphites",
+}
+
+MEAT_TERMS = ["meat", "chicken", "beef", "pork", "lamb", "mutton", "goat", "veal", "turkey", "duck", "bacon",
+              "ham", "sausage", "salami", "pepperoni", "chorizo", "prosciutto", "gelatin", "gelatine", "lard",
+              "tallow", "anchovy", "anchovies", "venison", "rennet", "carmine", "cochineal"]
+ANIMAL_TERMS = ["honey", "beeswax", "egg", "eggnog"] + ALLERGEN_TERMS["Milk"]
+SEAFOOD_ALLERGENS = ("Fish", "Crustaceans", "Molluscs")
+
+# Usually made from wheat: reported as likely gluten unless the same phrase
+# names a gluten-free grain ("rice noodles", "buckwheat flour").
+GLUTEN_STAPLES = ["bread", "breadcrumb", "pasta", "spaghetti", "macaroni", "lasagne", "lasagna", "noodle",
+                  "flour", "pizza", "biscuit", "cracker", "cake", "cookie", "pastry", "croissant", "dumpling",
+                  "roti", "chapati", "naan", "paratha", "udon", "ramen"]
+GLUTEN_FREE_GRAINS = ["rice", "buckwheat", "corn", "maize", "quinoa", "millet", "sorghum", "tapioca", "cassava",
+                      "chickpea", "gram", "teff", "amaranth", "gluten-free", "gluten free"]
+
+
+def alternation(terms):
+    # Longest alternatives first so "peanut butter" style phrases win over
+    # their prefixes; one pass over the text finds every term.
+    return "|".join(re.escape(term) for term in sorted(set(terms), key=len, reverse=True))
+
+
+def compile_terms(terms):
+    return re.compile(rf"\b({alternation(terms)})(?:e?s)?\b", re.IGNORECASE)
+
+
+TERM_ALLERGENS = {term: allergen for allergen, terms in ALLERGEN_TERMS.items() for term in terms}
+ALLERGEN_RE = compile_terms(TERM_ALLERGENS)
+MEAT_RE = compile_terms(MEAT_TERMS)
+ANIMAL_RE = compile_terms(ANIMAL_TERMS)
+GLUTEN_STAPLES_RE = compile_terms(GLUTEN_STAPLES)
+GLUTEN_FREE_GRAINS_RE = compile_terms(GLUTEN_FREE_GRAINS)
+PHRASE_RE = re.compile(r"[,;:()\[\]\n]")
+# "Peanut butter" is peanut, not milk; "oat milk" is oat; goat's cheese is cheese, not meat.
+NOT_ALLERGENS = re.compile(
+    r"\b(?:(peanut|cocoa|shea|nut|apple|almond|cashew) butter|(coconut|almond|oat|soy|soya|rice|cashew) milk"
+    r"|goat(?:'s|s'?)? (milk|cheese|yogh?urt|curd))\b|\bcream of tartar\b",
+    re.IGNORECASE,
+)
+# "Lactose-free", "fish-free": drop just that word. Whatever else the phrase
+# names still counts, so lactose-free milk is still milk.
+FREE_OF_RE = re.compile(rf"\b(?:{alternation(list(TERM_ALLERGENS) + MEAT_TERMS)})(?:e?s)?[- ]free\b",
+                        re.IGNORECASE)
+
+
+def strip_false_friends(text):
+    text = NOT_ALLERGENS.sub(lambda match: match.group(1) or match.group(2) or match.group(3) or " ", text)
+    return FREE_OF_RE.sub(" ", text)
+
+
+def gluten_staples(text):
+    """Wheat-typical staples in phrases that name no gluten-free grain."""
+    staples = []
+    for phrase in PHRASE_RE.split(text or ""):
+        if not GLUTEN_FREE_GRAINS_RE.search(phrase):
+            staples += [match.group(1).lower() for match in GLUTEN_STAPLES_RE.finditer(phrase)]
+    return list(dict.fromkeys(staples))
+
+
+def find_allergens(text, staples=True):
+    """Allergens mentioned in free text, in order of first mention.
+
+    With staples, wheat-typical foods such as pasta also count as gluten.
+
+    >>> find_allergens("Wheat flour, dairy-free cheese (coconut oil), peanut butter")
+    ['Gluten', 'Milk', 'Peanuts']
+    >>> find_allergens("lactose-free milk, casein-free cheesecake, eggnog")
+    ['Milk', 'Eggs']
+    >>> find_allergens("Spaghetti bolognese")
+    ['Gluten']
+    >>> find_allergens("rice noodles, gluten-free bread, buckwheat flour")
+    []
+    """
+    if not text:
+        return []
+    found = {}
+    for match in ALLERGEN_RE.finditer(strip_false_friends(text)):
+        found.setdefault(TERM_ALLERGENS[match.group(1).lower()], None)
+    if staples and gluten_staples(text):
+        found.setdefault("Gluten", None)
+    return list(found)
+
+
+def tag_allergens(tags):
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split(",")]
+    return [ALLERGEN_TAGS[tag] for tag in tags or [] if tag in ALLERGEN_TAGS]
+
+
+def product_text(product_info):
+    parts = [product_info.get(field) for field in ("product_name", "ingredients_text", "ingredients",
+                                                   "important_ingredients")]
+    return " ; ".join(part for part in parts if isinstance(part, str) and part)
+
+
+def dietary_type(text, labels=None):
+    """Vegan / Vegetarian / Non-Vegetarian from labels first, then ingredient words.
+
+    >>> dietary_type("fish-free vegetable broth")
+    'Likely Vegan (please verify ingredients)'
+    >>> dietary_type("goat cheese, spinach")
+    'Vegetarian'
+    >>> dietary_type("goat curry")
+    'Non-Vegetarian'
+    """
+    labels = labels or []
+    if "en:vegan" in labels:
+        return "Vegan"
+    if "en:vegetarian" in labels:
+        return "Vegetarian"
+    text = strip_false_friends(text or "")
+    if MEAT_RE.search(text) or any(allergen in SEAFOOD_ALLERGENS for allergen in find_allergens(text)):
+        return "Non-Vegetarian"
+    if ANIMAL_RE.search(text):
+        return "Vegetarian"
+    if text.strip():
+        return "Likely Vegan (please verify ingredients)"
+    return "Not specified"
+
+
+def check_product(product_info, user_allergies=""):
+    """Deterministic allergen verdict for a product against the user's declared allergies.
+
+    Returns {"contains", "likely", "traces", "conflicts", "unmatched", "known",
+    "dietary"}: the allergens from tags and ingredient text, the wheat-typical
+    staples behind a Gluten that only they suggest, possible traces, which of
+    them the user listed, and the user's entries the taxonomy doesn't know
+    (those are matched literally against the ingredient text instead). known
+    is False when there is no ingredient list or allergen tags to go on, only
+    a name, as for food photos.
+    """
+    text = product_text(product_info)
+    contains = list(dict.fromkeys(tag_allergens(product_info.get("allergens_tags") or product_info.get("allergens"))
+                                  + find_allergens(text, staples=False)))
+    likely = []
+    if "Gluten" not in contains:
+        likely = gluten_staples(text)
+        if likely:
+            contains.append("Gluten")
+    traces = [allergen for allergen in tag_allergens(product_info.get("traces_tags")) if allergen not in contains]
+
+    conflicts, unmatched = [], []
+    for entry in re.split(r"[,;/\n]| and ", user_allergies or ""):
+        entry = entry.strip()
+        if not entry or entry.lower() in ("none", "no", "n/a", "na"):
+            continue
+        wanted = find_allergens(entry)
+        if wanted:
+            conflicts += [allergen for allergen in wanted if allergen in contains or allergen in traces]
+        else:
+            unmatched.append(entry)
+            if re.search(rf"\b{re.escape(entry)}", text, re.IGNORECASE):
+                conflicts.append(entry)
+
+    return {
+        "contains": contains,
+        "likely": likely,
+        "traces": traces,
+        "conflicts": list(dict.fromkeys(conflicts)),
+        "unmatched": unmatched,
+        "known": bool(product_info.get("ingredients_text") or product_info.get("allergens_tags")
+                      or product_info.get("traces_tags")),
+        "dietary": product_info.get("dietary") or dietary_type(text, product_info.get("labels_tags")),
+    }
+
+
+def allergen_report(product_info, user_allergies=""):
+    """Markdown for the /product allergens section.
+
+    >>> print(allergen_report({"product_name": "Pad Thai"}, "peanuts"))
+    - Ingredients unknown: allergens can't be ruled out. Check the packaging or ask before eating.
+    - Your listed allergies (peanuts) can't be ruled out without an ingredient list
+    """
+    verdict = check_product(product_info, user_allergies)
+    lines = []
+    if verdict["conflicts"]:
+        lines.append(f"⚠️ **{', '.join(verdict['conflicts'])}**: you listed this as an allergy.")
+    if verdict["contains"]:
+        lines += [f"- **{allergen}**" if allergen != "Gluten" or not verdict["likely"]
+                  else f"- **Gluten** (likely, usually made from wheat: {', '.join(verdict['likely'])})"
+                  for allergen in verdict["contains"]]
+    elif verdict["known"]:
+        lines.append("No major allergens detected, but always check labels for cross-contamination")
+    if verdict["traces"]:
+        lines.append(f"- May contain traces of: **{', '.join(verdict['traces'])}**")
+    if not verdict["known"]:
+        lines.append("- Ingredients unknown: allergens can't be ruled out. Check the packaging or ask before eating.")
+        if user_allergies and not verdict["conflicts"]:
+            lines.append(f"- Your listed allergies ({user_allergies}) can't be ruled out without an ingredient list")
+    elif user_allergies and not verdict["conflicts"]:
+        lines.append(f"- None of your listed allergies ({user_allergies}) were found")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,24 +1,149 @@
 import base64
+import json
+import multiprocessing
 import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import cv2
 import numpy as np
 from barcode import BarcodeScanner
+from barcode_decoder import decode_bytes, init_worker
+from camera import CameraStream
 from food_recognizer import FoodRecognizer
-from chatbot import ChatBot
-from flask import Flask, Response, jsonify, redirect, render_template, request, url_for
+from live_scan import LiveBarcodeScanner
+from model_router import router
+from chatbot import UNAVAILABLE_MESSAGE, ChatBot
+from http_client import client_stats
+from flask import (Flask, Request, Response, current_app, g, jsonify, redirect, render_template, request, send_file,
+                   stream_with_context, url_for)
+from product_insights import ProductInsights
+from resilience import Deadline, breaker_stats
+from session_store import create_session_store
+from werkzeug.exceptions import RequestEntityTooLarge
 
-app = Flask(__name__)
+# MAX_UPLOAD_BYTES caps one image; /scan_batch takes many, up to BATCH_MAX_BYTES in total.
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class UploadRequest(Request):
+    @property
+    def max_content_length(self):
+        if self.endpoint == "scan_batch":
+            return BATCH_MAX_BYTES
+        return current_app.config["MAX_CONTENT_LENGTH"]
 
-user_data = {}
-scanned_data = {}
-scanner = BarcodeScanner()
-food_recognizer = FoodRecognizer()
-chatbot = ChatBot()
 
+app = Flask(__name__)
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Client-side capture settings: frames are downscaled to this longest edge
+# and JPEG-encoded at this quality before upload.
+CAPTURE_MAX_EDGE = int(os.getenv("CAPTURE_MAX_EDGE", "1280"))
+CAPTURE_QUALITY = float(os.getenv("CAPTURE_QUALITY", "0.85"))
+# End-to-end budget, in seconds, shared by the upstream calls of one request.
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "15"))
+
+SESSION_COOKIE = "kenshoku_sid"
+SESSION_ID_RE = re.compile(r"[A-Za-z0-9_-]{16,64}")
 SAVE_PATH = os.path.join(os.getcwd(), "barcode_scans")
-if not os.path.exists(SAVE_PATH):
-    os.makedirs(SAVE_PATH)
+
+# Batch-decode workers are spawned, so each one imports this file again as
+# __mp_main__ before it can run decode_bytes. Only barcode_decoder is needed
+# there: the USDA index, caches and API clients are built in the server only.
+SERVER_PROCESS = __name__ != "__mp_main__"
+
+if SERVER_PROCESS:
+    session_store = create_session_store(
+        os.getenv("SESSION_STORE", "memory"),
+        ttl=float(os.getenv("SESSION_TTL", str(7 * 24 * 3600))),
+    )
+    scanner = BarcodeScanner()
+    food_recognizer = FoodRecognizer()
+    chatbot = ChatBot()
+    camera = CameraStream(
+        device=int(os.getenv("CAMERA_DEVICE", "0")),
+        fps=float(os.getenv("CAMERA_FPS", "15")),
+        jpeg_quality=int(os.getenv("CAMERA_JPEG_QUALITY", "80")),
+    )
+    live_scanner = LiveBarcodeScanner(
+        camera,
+        stride=int(os.getenv("LIVE_SCAN_STRIDE", "5")),
+        scale=float(os.getenv("LIVE_SCAN_SCALE", "0.5")),
+        roi=float(os.getenv("LIVE_SCAN_ROI", "0.7")),
+    )
+    if not os.path.exists(SAVE_PATH):
+        os.makedirs(SAVE_PATH)
+
+# Uploaded images are decoded straight from memory; writing a copy to
+# SAVE_PATH (for /get_captured_image) happens off the request thread.
+SAVE_SCANS = os.getenv("SAVE_SCANS", "1") == "1"
+if SERVER_PROCESS:
+    image_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-writer")
+
+
+def decode_data_url(data):
+    if "," in data:
+        data = data.split(",", 1)[1]
+    return base64.b64decode(data)
+
+
+def decode_frame(image_data):
+    # pyzbar only looks at one channel, so let libjpeg produce grayscale
+    # directly instead of decoding colour and discarding it.
+    np_arr = np.frombuffer(image_data, np.uint8)
+    return cv2.imdecode(np_arr, cv2.IMREAD_GRAYSCALE)
+
+
+def write_image(filename, image_data):
+    image_path = os.path.join(SAVE_PATH, filename)
+    tmp_path = f"{image_path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(image_data)
+        os.replace(tmp_path, image_path)
+        print(f"Image saved to: {image_path}")
+    except OSError as e:
+        print(f"Error saving image {image_path}: {e}")
+    prune_images()
+
+
+SCAN_PRUNE_INTERVAL = float(os.getenv("SCAN_PRUNE_INTERVAL", "3600"))
+last_pruned = 0.0
+
+
+def prune_images():
+    """Delete saved scans untouched for a session lifetime; their sessions have expired.
+
+    Runs on the image_writer thread at most every SCAN_PRUNE_INTERVAL seconds.
+    """
+    global last_pruned
+    now = time.time()
+    if now - last_pruned < SCAN_PRUNE_INTERVAL:
+        return
+    last_pruned = now
+    removed = 0
+    for entry in os.scandir(SAVE_PATH):
+        if not entry.name.startswith("scan_"):
+            continue
+        try:
+            if now - entry.stat().st_mtime > session_store.ttl:
+                os.remove(entry.path)
+                removed += 1
+        except OSError as e:
+            print(f"Error pruning image {entry.path}: {e}")
+    if removed:
+        print(f"Pruned {removed} saved scan(s) older than the session TTL")
+
+
+def save_image(filename, image_data):
+    if SAVE_SCANS:
+        image_writer.submit(write_image, filename, image_data)
 
 
 @app.route("/")
@@ -26,18 +151,70 @@ def entry():
     return render_template("entry.html")
 
 
+@app.before_request
+def load_session():
+    # The cookie only carries a random id; the profile and last scan live in
+    # session_store so any worker can serve any request.
+    g.sid = request.cookies.get(SESSION_COOKIE, "")
+    # The id ends up in file names, so only accept what token_urlsafe produces.
+    g.new_session = not SESSION_ID_RE.fullmatch(g.sid)
+    if g.new_session:
+        g.sid = secrets.token_urlsafe(16)
+
+
+@app.before_request
+def start_deadline():
+    # Every upstream call made for this request (Open Food Facts, USDA, Groq)
+    # draws its timeout from this one budget.
+    g.deadline = Deadline(REQUEST_DEADLINE)
+
+
+@app.after_request
+def store_session_cookie(response):
+    if getattr(g, "new_session", False):
+        response.set_cookie(SESSION_COOKIE, g.sid, max_age=int(session_store.ttl),
+                            httponly=True, samesite="Lax")
+    return response
+
+
+def get_user_data():
+    return session_store.load(g.sid).get("user_data", {})
+
+
+def get_scanned_data():
+    return session_store.load(g.sid).get("scanned_data", {})
+
+
+def update_session(**fields):
+    state = session_store.load(g.sid)
+    state.update(fields)
+    session_store.save(g.sid, state)
+
+
+def remember_scan(product_info):
+    """Make product_info the session's current scan and start on its /product page."""
+    state = session_store.load(g.sid)
+    state["scanned_data"] = product_info
+    # A new product starts a new conversation.
+    state.pop("chat", None)
+    session_store.save(g.sid, state)
+    product_insights.prefetch(g.sid, state.get("user_data", {}), product_info)
+
+
+def session_image_name():
+    return f"scan_{g.sid}.jpg"
+
+
 @app.route("/save_user_data", methods=["POST"])
 def save_user_data():
-    global user_data
     user_data = request.form.to_dict()
+    update_session(user_data=user_data)
     print(f"User data saved: {user_data}")
     return redirect(url_for("scan"))
 
 
 @app.route("/scan", methods=["GET", "POST"])
 def scan():
-    global scanned_data
-
     if request.method == "POST":
         try:
             if 'image' not in request.files and 'image' not in request.form:
@@ -54,21 +231,7 @@ def scan():
                         "status": "failed"
                     }), 400
 
-                image_path = os.path.join(SAVE_PATH, "uploaded_image.jpg")
-                file.save(image_path)
-
-                product_info = scanner.scan_barcode(image_path)
-                if product_info:
-                    scanned_data = product_info
-                    return jsonify({
-                        "status": "success",
-                        "product": product_info
-                    }), 200
-                else:
-                    return jsonify({
-                        "message": "No barcode found in the image",
-                        "status": "failed"
-                    }), 400
+                image_data = file.read()
 
             elif 'image' in request.form or request.is_json:
                 if request.is_json:
@@ -82,36 +245,32 @@ def scan():
                         "status": "failed"
                     }), 400
 
-                if "," in data:
-                    image_data = base64.b64decode(data.split(",")[1])
-                else:
-                    image_data = base64.b64decode(data)
-
-                np_arr = np.frombuffer(image_data, np.uint8)
-                frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+                image_data = decode_data_url(data)
 
-                if frame is None:
-                    return jsonify({
-                        "message": "Failed to decode image",
-                        "status": "failed"
-                    }), 400
+            frame = decode_frame(image_data)
+            if frame is None:
+                return jsonify({
+                    "message": "Failed to decode image",
+                    "status": "failed"
+                }), 400
 
-                image_path = os.path.join(SAVE_PATH, "uploaded_image.jpg")
-                cv2.imwrite(image_path, frame)
+            save_image(session_image_name(), image_data)
 
-                product_info = scanner.scan_barcode(image_path)
-                if product_info:
-                    scanned_data = product_info
-                    return jsonify({
-                        "status": "success",
-                        "product": product_info
-                    }), 200
-                else:
-                    return jsonify({
-                        "message": "No barcode found in the image",
-                        "status": "failed"
-                    }), 400
+            product_info = scanner.scan_image(frame, g.deadline)
+            if product_info:
+                remember_scan(product_info)
+                return jsonify({
+                    "status": "success",
+                    "product": product_info
+                }), 200
+            else:
+                return jsonify({
+                    "message": "No barcode found in the image",
+                    "status": "failed"
+                }), 400
 
+        except RequestEntityTooLarge:
+            raise
         except Exception as e:
             print(f"Error in /scan endpoint: {e}")
             import traceback
@@ -121,7 +280,113 @@ def scan():
                 "status": "failed"
             }), 500
 
-    return render_template("scan.html")
+    return render_template("scan.html", capture_max_edge=CAPTURE_MAX_EDGE,
+                           capture_quality=CAPTURE_QUALITY,
+                           max_upload_bytes=app.config["MAX_CONTENT_LENGTH"])
+
+
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "50"))
+BATCH_DECODE_WORKERS = int(os.getenv("BATCH_DECODE_WORKERS", str(os.cpu_count() or 2)))
+decode_pool = None
+decode_pool_lock = threading.Lock()
+
+
+def get_decode_pool(reset=False):
+    # Created on first use (not at import). Spawned workers start from a fresh
+    # interpreter instead of a fork of the server's threads and locks; see
+    # SERVER_PROCESS for what they skip when they re-import this file.
+    global decode_pool
+    with decode_pool_lock:
+        if reset and decode_pool is not None:
+            decode_pool.shutdown(wait=False, cancel_futures=True)
+            decode_pool = None
+        if decode_pool is None:
+            decode_pool = ProcessPoolExecutor(max_workers=BATCH_DECODE_WORKERS,
+                                              mp_context=multiprocessing.get_context("spawn"),
+                                              initializer=init_worker)
+        return decode_pool
+
+
+def record_batch_decode(result, outcome):
+    symbols, timings = outcome
+    scanner.decoder_stats.record(timings)
+    if symbols:
+        result["barcode"] = symbols[0]["data"]
+    else:
+        result.update(status="failed", message="No barcode found in the image")
+
+
+@app.route("/scan_batch", methods=["POST"])
+def scan_batch():
+    files = request.files.getlist("images") or request.files.getlist("image")
+    if not files:
+        return jsonify({
+            "message": "No images provided. Upload one or more files as 'images'.",
+            "status": "failed"
+        }), 400
+
+    if len(files) > BATCH_MAX_IMAGES:
+        return jsonify({
+            "message": f"Too many images: {len(files)}. The limit is {BATCH_MAX_IMAGES} per batch.",
+            "status": "failed"
+        }), 400
+
+    pool = get_decode_pool()
+    results = []
+    images = []
+    futures = []
+    max_image_bytes = app.config["MAX_CONTENT_LENGTH"]
+    for index, file in enumerate(files):
+        results.append({"index": index, "filename": file.filename})
+        images.append(file.read())
+        if len(images[-1]) > max_image_bytes:
+            results[-1].update(status="failed",
+                               message=f"Image is too large. The limit is {max_image_bytes / (1024 * 1024):.1f} MB.")
+            futures.append(None)
+            continue
+        futures.append(pool.submit(decode_bytes, images[-1], scanner.fast_max_edge, scanner.max_regions))
+
+    # A worker crash breaks every pending future in the pool, so slots that
+    # saw BrokenProcessPool are retried one at a time on a fresh pool; only
+    # the image that really crashes it ends up failed.
+    retry = []
+    for index, future in enumerate(futures):
+        if future is None:
+            continue
+        try:
+            record_batch_decode(results[index], future.result())
+        except BrokenProcessPool:
+            retry.append(index)
+        except Exception as e:
+            results[index].update(status="failed", message=str(e))
+
+    broken = bool(retry)
+    for index in retry:
+        try:
+            future = get_decode_pool(reset=broken).submit(
+                decode_bytes, images[index], scanner.fast_max_edge, scanner.max_regions)
+            broken = False
+            record_batch_decode(results[index], future.result())
+        except BrokenProcessPool:
+            broken = True
+            results[index].update(status="failed", message="Image crashed the barcode decoder")
+        except Exception as e:
+            results[index].update(status="failed", message=str(e))
+    if broken:
+        get_decode_pool(reset=True)
+
+    products = scanner.fetch_many((result["barcode"] for result in results if "barcode" in result), g.deadline)
+    for result in results:
+        if "barcode" not in result:
+            continue
+        product_info = products.get(result["barcode"])
+        if product_info:
+            result.update(status="success", product=product_info)
+        else:
+            result.update(status="failed", message="Product not found")
+
+    print(f"Batch scan: {len(results)} image(s), {len(products)} distinct barcode(s)")
+    return jsonify({"status": "success", "results": results}), 200
 
 
 @app.route("/video_feed")
@@ -130,63 +395,115 @@ def video_feed():
 
 
 def gen_frames():
-    cap = cv2.VideoCapture(0)
-    while True:
-        success, frame = cap.read()
-        if not success:
-            break
-        else:
-            ret, buffer = cv2.imencode(".jpg", frame)
-            frame = buffer.tobytes()
-            yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+    for frame in camera.frames():
+        yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+
+
+@app.route("/live_scan")
+def live_scan():
+    """Server-Sent Events stream of barcodes read from the /video_feed camera.
+
+    Everyone watching the camera sees every detection, so the stream only
+    names the barcode; a client that wants it posts it back to /live_scan,
+    which looks it up for that client's session alone.
+    """
+    def events():
+        yield sse_event("ready", {})
+        for barcode in live_scanner.events():
+            if barcode is None:
+                yield ": keepalive\n\n"
+                continue
+            yield sse_event("barcode", {"barcode": barcode})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/live_scan", methods=["POST"])
+def select_live_scan():
+    barcode = request.form.get("barcode", "").strip()
+    if not barcode or len(barcode) > 64:
+        return jsonify({
+            "message": "No barcode provided. Include the 'barcode' from a /live_scan event.",
+            "status": "failed"
+        }), 400
+
+    product_info = scanner.fetch_nutritional_data(barcode, g.deadline)
+    if product_info:
+        remember_scan(product_info)
+        return jsonify({"status": "success", "product": product_info}), 200
+    return jsonify({
+        "message": f"No product found for barcode {barcode}.",
+        "status": "failed"
+    }), 404
+
+
+def read_capture_request():
+    """Return (image bytes, mode) from a raw, multipart or JSON capture.
+
+    Raw bodies (image/* or application/octet-stream, mode in the query
+    string) are what scan.html sends; they skip the base64 round trip.
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        mode = payload.get("mode", "barcode")
+        if "image" not in payload:
+            return None, mode
+        return (decode_data_url(payload["image"]) if payload["image"] else b""), mode
+
+    if "image" in request.files:
+        return request.files["image"].read(), request.form.get("mode", "barcode")
+
+    mode = request.args.get("mode", "barcode")
+    if request.mimetype.startswith("image/") or request.mimetype == "application/octet-stream":
+        return request.get_data(cache=False), mode
+    return None, mode
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    if request.endpoint == "scan_batch":
+        message = f"Batch is too large. The limit is {BATCH_MAX_BYTES / (1024 * 1024):.1f} MB per batch."
+    else:
+        message = f"Image is too large. The limit is {app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024):.1f} MB."
+    return jsonify({
+        "message": message,
+        "status": "failed"
+    }), 413
 
 
 @app.route("/capture_frame", methods=["POST"])
 def capture_frame():
-    global scanned_data
-
     try:
-        if not request.json or "image" not in request.json:
-            return jsonify({
-                "message": "No image data provided. Expected JSON with 'image' field.",
-                "status": "failed"
-            }), 400
-
-        data = request.json["image"]
-        mode = request.json.get("mode", "barcode")  
+        image_data, mode = read_capture_request()
 
         print(f"Capture mode: {mode}")
 
-        if not data:
+        if image_data is None:
             return jsonify({
-                "message": "Image data is empty",
+                "message": "No image data provided. Expected an image body, a multipart 'image' file or JSON with 'image' field.",
                 "status": "failed"
             }), 400
 
-        if "," in data:
-            image_data = base64.b64decode(data.split(",")[1])
-        else:
-            image_data = base64.b64decode(data)
-
-        np_arr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-        if frame is None:
+        if not image_data:
             return jsonify({
-                "message": "Failed to decode image data",
+                "message": "Image data is empty",
                 "status": "failed"
             }), 400
 
-        image_filename = "captured_frame.jpg" if mode == "barcode" else "food_image.jpg"
-        image_path = os.path.join(SAVE_PATH, image_filename)
-        cv2.imwrite(image_path, frame)
-        print(f"Image saved to: {image_path}")
-
         if mode == "barcode":
             print("Processing in BARCODE mode...")
-            product_info = scanner.scan_barcode(image_path)
+            frame = decode_frame(image_data)
+            if frame is None:
+                return jsonify({
+                    "message": "Failed to decode image data",
+                    "status": "failed"
+                }), 400
+
+            save_image(session_image_name(), image_data)
+            product_info = scanner.scan_image(frame, g.deadline)
             if product_info:
-                scanned_data = product_info
+                remember_scan(product_info)
                 return jsonify({"status": "success", "product": product_info}), 200
             else:
                 return jsonify({
@@ -194,11 +511,34 @@ def capture_frame():
                     "status": "failed"
                 }), 400
 
+        elif mode == "shelf":
+            print("Processing in SHELF mode...")
+            frame = decode_frame(image_data)
+            if frame is None:
+                return jsonify({
+                    "message": "Failed to decode image data",
+                    "status": "failed"
+                }), 400
+
+            save_image(session_image_name(), image_data)
+            items = scanner.scan_shelf(frame, g.deadline)
+            found = [item for item in items if item["product"]]
+            if found:
+                remember_scan(found[0]["product"])
+                return jsonify({"status": "success", "items": items}), 200
+            else:
+                return jsonify({
+                    "message": "No known products found in the captured image.",
+                    "status": "failed",
+                    "items": items
+                }), 400
+
         elif mode == "food":
             print("Processing in FOOD RECOGNITION mode...")
-            product_info = food_recognizer.recognize_food(image_path)
+            save_image(session_image_name(), image_data)
+            product_info = food_recognizer.recognize_food_image(image_data, g.deadline)
             if product_info:
-                scanned_data = product_info
+                remember_scan(product_info)
                 return jsonify({"status": "success", "product": product_info}), 200
             else:
                 return jsonify({
@@ -208,10 +548,12 @@ def capture_frame():
 
         else:
             return jsonify({
-                "message": f"Invalid mode: {mode}. Expected 'barcode' or 'food'.",
+                "message": f"Invalid mode: {mode}. Expected 'barcode', 'shelf' or 'food'.",
                 "status": "failed"
             }), 400
 
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         print(f"Error in /capture_frame: {e}")
         import traceback
@@ -222,95 +564,44 @@ def capture_frame():
         }), 500
 
 
-@app.route("/product")
-def product():
-    ai_summary = None
-    ai_alternatives = None
-    enhanced_ingredients = None
-    enhanced_allergens = None
-    enhanced_calories = None
+PRODUCT_SECTION_WORKERS = int(os.getenv("PRODUCT_SECTION_WORKERS", "5"))
+PRODUCT_SECTION_TIMEOUT = float(os.getenv("PRODUCT_SECTION_TIMEOUT", "8"))
+if SERVER_PROCESS:
+    product_insights = ProductInsights(
+        chatbot,
+        workers=PRODUCT_SECTION_WORKERS,
+        timeout=PRODUCT_SECTION_TIMEOUT,
+        prefetch_workers=int(os.getenv("PRODUCT_PREFETCH_WORKERS", "3")),
+        combined=os.getenv("PRODUCT_SECTIONS_MODE", "combined") == "combined",
+    )
 
-    if scanned_data and user_data:
-        try:
-            summary_prompt = f"""Based on this person's profile and the food item, provide a brief personalized analysis (max 100 words):
-- Is this food good for their health goals?
-- Any concerns based on their allergies or dietary preferences?
-- Brief recommendation.
-
-Use **bold** for important nutrients, allergens, or food names. Keep it friendly and concise."""
-            ai_summary = chatbot.get_response(user_data, scanned_data, summary_prompt)
-        except Exception as e:
-            print(f"Error generating AI summary: {e}")
-            ai_summary = None
-
-        try:
-            alternatives_prompt = f"""Based on the scanned food and user's profile, suggest alternatives (max 120 words):
-
-If the food is already healthy for their goals: Start with "This food is good enough, no alternatives needed. But if you want variety, try:" then list 2-3 similar healthy options.
-
-If the food is unhealthy or doesn't align with their goals: Suggest 3-4 better alternatives that match their dietary preferences and health goals.
-
-Format with **bold** food names and brief explanation why each alternative is better."""
-            ai_alternatives = chatbot.get_response(user_data, scanned_data, alternatives_prompt)
-        except Exception as e:
-            print(f"Error generating alternatives: {e}")
-            ai_alternatives = None
-
-        try:
-            ingredients_prompt = f"""Provide detailed information about the key ingredients in this food (max 100 words):
-- List main ingredients with **bold** names
-- Brief health benefits or concerns for each
-- Note any processing or additives if applicable
-
-Format with bullet points."""
-            enhanced_ingredients = chatbot.get_response({}, scanned_data, ingredients_prompt)
-        except Exception as e:
-            print(f"Error generating ingredients: {e}")
-            enhanced_ingredients = scanned_data.get('important_ingredients', 'Not specified')
 
-        try:
-            allergens_prompt = f"""Provide comprehensive allergen information for this food (max 80 words):
-- List all potential allergens with **bold** names
-- Include common cross-contamination risks
-- Note hidden allergens in processing
+@app.route("/product")
+def product():
+    sections = {
+        "ai_summary": None,
+        "ai_alternatives": None,
+        "enhanced_ingredients": None,
+        "enhanced_allergens": None,
+        "enhanced_calories": None,
+    }
 
-If no allergens: Say "No major allergens detected, but always check labels for cross-contamination" """
-            enhanced_allergens = chatbot.get_response({}, scanned_data, allergens_prompt)
-        except Exception as e:
-            print(f"Error generating allergens: {e}")
-            enhanced_allergens = scanned_data.get('allergens', 'None listed')
+    user_data = get_user_data()
+    scanned_data = get_scanned_data()
 
-        try:
-            calories_prompt = f"""Provide detailed calorie and macronutrient breakdown (max 100 words):
-- Total calories per serving with **bold** number
-- Breakdown: **Protein**, **Carbs**, **Fats** with amounts
-- Compare to daily recommended intake
-- Note if high/low in any macronutrient
-
-Format clearly with bullet points."""
-            enhanced_calories = chatbot.get_response({}, scanned_data, calories_prompt)
-        except Exception as e:
-            print(f"Error generating calories: {e}")
-            enhanced_calories = f"{scanned_data.get('calories', 'Not specified')} kcal per 100g"
+    if scanned_data and user_data:
+        sections = product_insights.sections(g.sid, user_data, scanned_data, g.deadline)
 
-    return render_template("product.html", product=scanned_data, user=user_data,
-                         ai_summary=ai_summary, ai_alternatives=ai_alternatives,
-                         enhanced_ingredients=enhanced_ingredients,
-                         enhanced_allergens=enhanced_allergens,
-                         enhanced_calories=enhanced_calories)
+    return render_template("product.html", product=scanned_data, user=user_data, **sections)
 
 
 @app.route("/get_captured_image")
 def get_captured_image():
     """Serve the captured/uploaded image"""
     try:
-        image_files = ["food_image.jpg", "captured_frame.jpg", "uploaded_image.jpg"]
-
-        for img_file in image_files:
-            image_path = os.path.join(SAVE_PATH, img_file)
-            if os.path.exists(image_path):
-                from flask import send_file
-                return send_file(image_path, mimetype='image/jpeg')
+        image_path = os.path.join(SAVE_PATH, session_image_name())
+        if os.path.exists(image_path):
+            return send_file(image_path, mimetype='image/jpeg')
 
         return "No image found", 404
     except Exception as e:
@@ -318,16 +609,33 @@ def get_captured_image():
         return "Error loading image", 500
 
 
+@app.route("/stats")
+def stats():
+    return jsonify({
+        "product_cache": scanner.cache.stats(),
+        "barcode_decoder": scanner.decoder_stats.snapshot(),
+        "chat_cache": chatbot.cache.stats(),
+        "vision_images": food_recognizer.image_stats_snapshot(),
+        "food_image_cache": food_recognizer.recent_images.stats(),
+        "http": client_stats(),
+        "circuit_breakers": breaker_stats(),
+        "product_prefetch": product_insights.stats(),
+        "models": router.stats(),
+    })
+
+
 @app.route("/chat")
 def chat():
-    return render_template("chat.html", user=user_data, product=scanned_data)
+    return render_template("chat.html", user=get_user_data(), product=get_scanned_data())
 
 
 @app.route("/ask_chatgpt", methods=["POST"])
 def ask_chatgpt():
     user_question = request.form["question"]
-    personal_info = user_data
-    product_info = scanned_data
+    state = session_store.load(g.sid)
+    personal_info = state.get("user_data", {})
+    product_info = state.get("scanned_data", {})
+    conversation = state.get("chat", {})
 
     print(f"\n=== CHAT REQUEST ===")
     print(f"User question: {user_question}")
@@ -335,9 +643,69 @@ def ask_chatgpt():
     print(f"Product info: {product_info}")
     print(f"===================\n")
 
-    response = chatbot.get_response(personal_info, product_info, user_question)
+    if request.form.get("stream") == "1":
+        def chunks():
+            parts = []
+            for chunk in chatbot.stream_response(personal_info, product_info, user_question, g.deadline,
+                                                 conversation=conversation):
+                parts.append(chunk)
+                yield chunk
+            remember_chat(conversation, user_question, "".join(parts))
+
+        return Response(stream_with_context(sse_events(chunks())), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    return jsonify({"answer": response})
+    response = chatbot.get_response(personal_info, product_info, user_question, g.deadline,
+                                    conversation=conversation)
+    remember_chat(conversation, user_question, response)
+
+    return jsonify({"answer": response or UNAVAILABLE_MESSAGE})
+
+
+chat_folds = set()
+chat_folds_lock = threading.Lock()
+
+
+def remember_chat(conversation, user_question, answer):
+    if not answer or answer.startswith("Error:") or answer == UNAVAILABLE_MESSAGE:
+        return
+    conversation, folded = chatbot.remember(conversation, user_question, answer)
+    update_session(chat=conversation)
+    if not folded:
+        return
+    # One fold per session at a time; the next turn past the budget picks up
+    # whatever this one leaves.
+    with chat_folds_lock:
+        if g.sid in chat_folds:
+            return
+        chat_folds.add(g.sid)
+    chatbot.summary_executor.submit(fold_chat, g.sid, conversation["summary"], folded)
+
+
+def fold_chat(sid, summary, folded):
+    """Background: summarize folded turns and swap them for the summary in the session."""
+    try:
+        summary = chatbot.summarize(summary, folded)
+        state = session_store.load(sid)
+        # A new scan, or a turn saved from an older copy of the session, means
+        # these turns are no longer at the front; keep the conversation as is.
+        conversation = chatbot.fold(state.get("chat"), folded, summary)
+        if conversation is not None:
+            state["chat"] = conversation
+            session_store.save(sid, state)
+    finally:
+        with chat_folds_lock:
+            chat_folds.discard(sid)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_events(chunks):
+    for chunk in chunks:
+        yield f"data: {json.dumps({'delta': chunk})}\n\n"
+    yield sse_event("done", {})
 
 
 if __name__ == "__main__":
@@ -1,38 +1,138 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
-from pyzbar.pyzbar import decode
+import numpy as np
 import requests
+from allergens import dietary_type
+from barcode_decoder import FAST_MAX_EDGE, MAX_REGIONS, DecoderStats, decode_staged
+from http_client import get_client
+from off_index import NUTRIMENT_FIELDS, OpenFoodFactsIndex
+from product_cache import ProductCache
+from resilience import UpstreamUnavailable
+
+CACHE_PATH = os.path.join(os.getcwd(), "cache")
+
 
 class BarcodeScanner:
+    def __init__(self, cache=None, index=None):
+        if cache is None:
+            cache = ProductCache(
+                path=os.getenv("PRODUCT_CACHE_PATH", os.path.join(CACHE_PATH, "products.sqlite")),
+                max_entries=int(os.getenv("PRODUCT_CACHE_SIZE", "2048")),
+                ttl=float(os.getenv("PRODUCT_CACHE_TTL", str(7 * 24 * 3600))),
+                negative_ttl=float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", str(24 * 3600))),
+            )
+        self.cache = cache
+
+        if index is None:
+            index_path = os.getenv("OFF_INDEX_PATH", os.path.join(CACHE_PATH, "off_index.sqlite"))
+            if os.path.exists(index_path):
+                index = OpenFoodFactsIndex(index_path)
+        self.index = index
+
+        self.fast_max_edge = int(os.getenv("BARCODE_FAST_EDGE", str(FAST_MAX_EDGE)))
+        self.max_regions = int(os.getenv("BARCODE_MAX_REGIONS", str(MAX_REGIONS)))
+        self.decoder_stats = DecoderStats()
+        lookup_workers = int(os.getenv("PRODUCT_LOOKUP_WORKERS", "8"))
+        self.lookup_executor = ThreadPoolExecutor(max_workers=lookup_workers, thread_name_prefix="product-lookup")
+        # Keep-alive connections to Open Food Facts, one per lookup worker.
+        self.http = get_client("openfoodfacts", pool_size=lookup_workers)
+
     def scan_barcode(self, image_path):
         barcode_data = self.decode_barcode(image_path)
         if barcode_data:
             return self.fetch_nutritional_data(barcode_data)
         return None
 
+    def scan_image(self, image, deadline=None):
+        barcode_data = self.decode_image(image)
+        if barcode_data:
+            return self.fetch_nutritional_data(barcode_data, deadline)
+        return None
+
     def decode_barcode(self, image_path):
-        img = cv2.imread(image_path)
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
         if img is None:
             print(f"Error: Could not read image at {image_path}")
             return None
 
-        barcodes = decode(img)
-        print(f"Found {len(barcodes)} barcode(s) in the image")
+        return self.decode_image(img)
+
+    def scan_shelf(self, image, deadline=None):
+        """Return every distinct barcode in the frame with its box and product."""
+        symbols = self.decode_symbols(image, exhaustive=True) or []
+        products = self.fetch_many((symbol["data"] for symbol in symbols), deadline)
+        return [
+            {
+                "barcode": symbol["data"],
+                "type": symbol["type"],
+                "rect": symbol["rect"],
+                "product": products.get(symbol["data"], {}),
+            }
+            for symbol in symbols
+        ]
 
-        for barcode in barcodes:
-            barcode_data = barcode.data.decode('utf-8')
+    def decode_image(self, image):
+        """Decode a barcode from an in-memory frame or encoded image bytes."""
+        symbols = self.decode_symbols(image)
+        if symbols is None:
+            return None
+
+        for symbol in symbols:
+            barcode_data = symbol["data"]
             print(f"Decoded barcode: {barcode_data}")
             return barcode_data
 
         print("No barcode detected in the image")
         return None
 
-    def fetch_nutritional_data(self, barcode):
+    def decode_symbols(self, image, exhaustive=False):
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print("Error: Could not decode image buffer")
+                return None
+
+        symbols, timings = decode_staged(image, self.fast_max_edge, self.max_regions, exhaustive)
+        self.decoder_stats.record(timings)
+        print("Decode stages: " + ", ".join(f"{stage} {ms}ms{' (hit)' if hit else ''}" for stage, ms, hit in timings))
+        print(f"Found {len(symbols)} barcode(s) in the image")
+        return symbols
+
+    def fetch_many(self, barcodes, deadline=None):
+        """Look up several barcodes concurrently; returns {barcode: product_info}."""
+        unique = list(dict.fromkeys(barcodes))
+        futures = {barcode: self.lookup_executor.submit(self.fetch_nutritional_data, barcode, deadline)
+                   for barcode in unique}
+
+        products = {}
+        for barcode, future in futures.items():
+            try:
+                products[barcode] = future.result()
+            except Exception as e:
+                print(f"Error fetching nutritional data for {barcode}: {e}")
+                products[barcode] = {}
+        return products
+
+    def fetch_nutritional_data(self, barcode, deadline=None):
+        found, product_info = self.cache.get(barcode)
+        if found:
+            print(f"Cache hit for barcode: {barcode}")
+            return product_info
+
+        if self.index is not None:
+            data = self.index.get(barcode)
+            if data is not None:
+                print(f"Offline index hit for barcode: {barcode}")
+                return self.parse_product(data)
+
         url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
         print(f"Fetching nutritional data for barcode: {barcode}")
         print(f"API URL: {url}")
 
         try:
-            response = requests.get(url, timeout=10)
+            response = self.http.get(url, deadline=deadline, hedge=True)
             print(f"API Response Status: {response.status_code}")
 
             if response.status_code == 200:
@@ -42,27 +142,42 @@ class BarcodeScanner:
                 data = json_response.get('product', {})
                 if not data:
                     print("Warning: Product data is empty")
+                    self.cache.set(barcode, {})
                     return {}
 
-                important_ingredients = [ingredient['text'] for ingredient in data.get('ingredients', []) if ingredient.get('percent_estimate', 0) > 5]
-                allergens = data.get('allergens_tags', ['None listed'])
-                dietary = 'Vegan' if 'en:vegan' in data.get('labels_tags', []) else 'Vegetarian' if 'en:vegetarian' in data.get('labels_tags', []) else 'Non-Vegetarian'
-
-                product_info = {
-                    'product_name': data.get('product_name', 'Unknown Product'),
-                    'image_url': data.get('image_url', ''),
-                    'description': data.get('generic_name', 'No description available'),
-                    'expiration_date': data.get('expiration_date', 'Not specified'),
-                    'calories': data.get('nutriments', {}).get('energy-kcal_100g', 'Not specified'),
-                    'allergens': ', '.join(allergens),
-                    'important_ingredients': ', '.join(important_ingredients),
-                    'dietary': dietary,
-                    'ingredients': ', '.join(important_ingredients)                  }
+                product_info = self.parse_product(data)
                 print(f"Product found: {product_info['product_name']}")
+                self.cache.set(barcode, product_info)
                 return product_info
             else:
                 print(f"API request failed with status code: {response.status_code}")
-                return {}
-        except requests.exceptions.RequestException as e:
+                return self.cache.get_stale(barcode) or {}
+        except (requests.exceptions.RequestException, UpstreamUnavailable) as e:
+            # Includes an open Open Food Facts circuit: fail fast to the stale entry.
             print(f"Error fetching nutritional data: {e}")
-            return {}
+            return self.cache.get_stale(barcode) or {}
+
+    def parse_product(self, data):
+        important_ingredients = [ingredient['text'] for ingredient in data.get('ingredients', []) if ingredient.get('percent_estimate', 0) > 5]
+        allergens = data.get('allergens_tags', ['None listed'])
+        ingredients_text = data.get('ingredients_text') or ', '.join(ingredient.get('text', '') for ingredient in data.get('ingredients', []))
+        dietary = dietary_type(ingredients_text, data.get('labels_tags', []))
+
+        return {
+            'product_name': data.get('product_name', 'Unknown Product'),
+            'image_url': data.get('image_url', ''),
+            'description': data.get('generic_name', 'No description available'),
+            'expiration_date': data.get('expiration_date', 'Not specified'),
+            'calories': data.get('nutriments', {}).get('energy-kcal_100g', 'Not specified'),
+            'allergens': ', '.join(allergens),
+            'important_ingredients': ', '.join(important_ingredients),
+            'dietary': dietary,
+            'ingredients': ', '.join(important_ingredients),
+            'ingredients_text': ingredients_text,
+            'allergens_tags': data.get('allergens_tags', []),
+            'traces_tags': data.get('traces_tags', []),
+            'labels_tags': data.get('labels_tags', []),
+            'nutriments': {field: value for field, value in data.get('nutriments', {}).items() if field in NUTRIMENT_FIELDS},
+            'serving_size': data.get('serving_size', ''),
+            'serving_quantity': data.get('serving_quantity'),
+        }
@@ -0,0 +1,187 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode
+
+# Longest edge of the first, cheap decoding pass.
+FAST_MAX_EDGE = 800
+# How many gradient-detected candidate regions to try before escalating.
+MAX_REGIONS = 3
+# Extra skew angles tried on the last stage; zbar already scans both axes.
+ROTATIONS = (45, -45)
+
+
+def to_gray(image):
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def decode_symbols(gray, transform=None):
+    """Decode gray and map each symbol's box back to original-image coordinates.
+
+    transform is a 2x3 affine matrix from this image's pixel coordinates
+    to the original image's; None means they are the same.
+    """
+    symbols = []
+    for barcode in decode(gray):
+        points = np.array([[x, y] for x, y in barcode.polygon] or
+                          [[barcode.rect.left, barcode.rect.top],
+                           [barcode.rect.left + barcode.rect.width, barcode.rect.top + barcode.rect.height]],
+                          dtype=np.float32)
+        if transform is not None:
+            points = cv2.transform(points.reshape(-1, 1, 2), transform).reshape(-1, 2)
+        left, top = points.min(axis=0)
+        right, bottom = points.max(axis=0)
+        symbols.append({
+            "data": barcode.data.decode("utf-8"),
+            "type": barcode.type,
+            "rect": [int(left), int(top), int(right - left), int(bottom - top)],
+        })
+    return symbols
+
+
+def candidate_regions(gray, max_regions=MAX_REGIONS):
+    """Return (x, y, w, h) boxes of areas dense in parallel bars, largest first."""
+    grad_x = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=-1))
+    grad_y = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=-1))
+    # Bars give a strong gradient along one axis only; text and edges give both.
+    gradient = cv2.blur(cv2.absdiff(grad_x, grad_y), (9, 9))
+    _, thresh = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    closed = np.maximum(
+        cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7))),
+        cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (7, 21))),
+    )
+    closed = cv2.dilate(cv2.erode(closed, None, iterations=4), None, iterations=4)
+
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = 0.01 * gray.shape[0] * gray.shape[1]
+    boxes = [cv2.boundingRect(contour) for contour in contours]
+    boxes = [box for box in boxes if box[2] * box[3] >= min_area]
+    boxes.sort(key=lambda box: box[2] * box[3], reverse=True)
+    return boxes[:max_regions]
+
+
+def rotate(gray, angle):
+    """Rotate without cropping; return the image and the inverse transform."""
+    height, width = gray.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width, new_height = int(height * sin + width * cos), int(height * cos + width * sin)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    rotated = cv2.warpAffine(gray, matrix, (new_width, new_height), borderValue=255)
+    return rotated, cv2.invertAffineTransform(matrix)
+
+
+def decode_staged(image, fast_max_edge=FAST_MAX_EDGE, max_regions=MAX_REGIONS, exhaustive=False):
+    """Decode barcodes with cheap passes first, escalating only on a miss.
+
+    Stages: downscaled -> candidate regions cropped at full resolution ->
+    full resolution -> contrast-normalized -> rotated. Returns (symbols,
+    timings) where timings is a list of (stage, milliseconds, hit).
+    With exhaustive=True every stage up to normalized runs and symbols are
+    merged, which finds more codes in crowded frames (shelf scans) at the
+    cost of speed; rotations are still only tried when nothing was found.
+    """
+    timings = []
+    found = {}
+
+    def run(stage, fn):
+        started = time.perf_counter()
+        symbols = fn()
+        timings.append((stage, round((time.perf_counter() - started) * 1000, 2), bool(symbols)))
+        for symbol in symbols:
+            found.setdefault(symbol["data"], symbol)
+        return bool(symbols) and not exhaustive
+
+    started = time.perf_counter()
+    gray = to_gray(image)
+    timings.append(("grayscale", round((time.perf_counter() - started) * 1000, 2), False))
+
+    height, width = gray.shape[:2]
+    scale = min(1.0, fast_max_edge / max(height, width))
+    small = gray
+    if scale < 1.0:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        to_full = np.array([[1 / scale, 0, 0], [0, 1 / scale, 0]], dtype=np.float32)
+        if run("downscaled", lambda: decode_symbols(small, to_full)):
+            return list(found.values()), timings
+
+    def regions():
+        symbols = []
+        for x, y, w, h in candidate_regions(small, max_regions):
+            # Boxes come from the small image; crop the same area, padded, at full resolution.
+            pad_x, pad_y = int(w * 0.15), int(h * 0.15)
+            left, top = max(0, int((x - pad_x) / scale)), max(0, int((y - pad_y) / scale))
+            right = min(width, int((x + w + pad_x) / scale))
+            bottom = min(height, int((y + h + pad_y) / scale))
+            offset = np.array([[1, 0, left], [0, 1, top]], dtype=np.float32)
+            symbols += decode_symbols(gray[top:bottom, left:right], offset)
+            if symbols and not exhaustive:
+                break
+        return symbols
+
+    if scale < 1.0:
+        if run("regions", regions):
+            return list(found.values()), timings
+    if run("full", lambda: decode_symbols(gray)):
+        return list(found.values()), timings
+
+    normalized = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    if run("normalized", lambda: decode_symbols(normalized)):
+        return list(found.values()), timings
+
+    for angle in ROTATIONS:
+        if found:
+            break
+        rotated, inverse = rotate(normalized, angle)
+        if run(f"rotated_{angle}", lambda: decode_symbols(rotated, inverse)):
+            break
+
+    return list(found.values()), timings
+
+
+def init_worker():
+    # Parallelism comes from the process pool; keep OpenCV single-threaded
+    # per worker so processes don't oversubscribe the cores.
+    cv2.setNumThreads(1)
+
+
+def decode_bytes(image_data, fast_max_edge=FAST_MAX_EDGE, max_regions=MAX_REGIONS, exhaustive=False):
+    """Process-pool entry point: decode encoded image bytes with decode_staged."""
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Failed to decode image")
+    return decode_staged(image, fast_max_edge, max_regions, exhaustive)
+
+
+class DecoderStats:
+    """Running per-stage run counts, hit counts and average latency."""
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(self, timings):
+        with self.lock:
+            for stage, ms, hit in timings:
+                entry = self.stages.setdefault(stage, {"runs": 0, "hits": 0, "total_ms": 0.0})
+                entry["runs"] += 1
+                entry["hits"] += int(hit)
+                entry["total_ms"] += ms
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                stage: {
+                    "runs": entry["runs"],
+                    "hits": entry["hits"],
+                    "hit_rate": round(entry["hits"] / entry["runs"], 3),
+                    "avg_ms": round(entry["total_ms"] / entry["runs"], 2),
+                }
+                for stage, entry in self.stages.items()
+            }
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class CameraStream:
+    """One capture thread per device, shared by every /video_feed viewer.
+
+    Each frame is read and JPEG-encoded once into a small ring buffer.
+    Viewers always jump to the newest frame, so a slow client drops
+    frames instead of building up a backlog. The device is released once
+    nobody has been watching for idle_timeout seconds.
+    """
+
+    def __init__(self, device=0, fps=15, jpeg_quality=80, buffer_size=4, idle_timeout=5.0):
+        self.device = device
+        self.frame_interval = 1.0 / fps if fps > 0 else 0
+        self.jpeg_quality = jpeg_quality
+        self.idle_timeout = idle_timeout
+        self.ring = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.subscribers = 0
+        self.running = False
+        self.thread = None
+        self.condition = threading.Condition()
+
+    def frames(self, raw=False):
+        """Yield JPEG bytes for each new frame until the client disconnects.
+
+        With raw=True, yield (seq, BGR ndarray) instead, for in-process
+        consumers such as the live barcode scanner.
+        """
+        with self.condition:
+            self.subscribers += 1
+            if not self.running:
+                self.running = True
+                self.ring.clear()
+                self.thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+                self.thread.start()
+
+        last_seen = 0
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: (self.ring and self.ring[-1][0] > last_seen) or not self.running,
+                        timeout=2.0,
+                    )
+                    if not self.ring or self.ring[-1][0] <= last_seen:
+                        if not self.running:
+                            return
+                        continue
+                    last_seen, jpeg, frame = self.ring[-1]
+                yield (last_seen, frame) if raw else jpeg
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def _run(self):
+        cap = cv2.VideoCapture(self.device)
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]
+        idle_since = None
+        print(f"Camera {self.device} opened")
+
+        try:
+            while True:
+                started = time.time()
+                with self.condition:
+                    if self.subscribers == 0:
+                        idle_since = idle_since or started
+                        if started - idle_since > self.idle_timeout:
+                            # Flip running under the lock so a viewer arriving
+                            # now starts a fresh thread instead of waiting on us.
+                            self.running = False
+                            break
+                    else:
+                        idle_since = None
+
+                success, frame = cap.read()
+                if not success:
+                    print(f"Camera {self.device} stopped delivering frames")
+                    break
+
+                ret, buffer = cv2.imencode(".jpg", frame, encode_params)
+                if ret:
+                    with self.condition:
+                        self.seq += 1
+                        self.ring.append((self.seq, buffer.tobytes(), frame))
+                        self.condition.notify_all()
+
+                delay = self.frame_interval - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            cap.release()
+            with self.condition:
+                if threading.current_thread() is self.thread:
+                    self.running = False
+                self.condition.notify_all()
+            print(f"Camera {self.device} released")
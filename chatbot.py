@@ -1,89 +1,332 @@
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 from groq import Groq
+from model_router import router
+from product_cache import ProductCache
+from resilience import UpstreamUnavailable
 
 load_dotenv()
 
+UNAVAILABLE_MESSAGE = "KenShoku AI is temporarily unavailable. Please try again in a moment."
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and KenShoku AI, a nutrition assistant, with the new exchanges below.
+Keep what matters for later questions: foods discussed, the user's stated preferences and concerns, and advice already given.
+Reply with the updated summary only, at most 120 words.
+
+Current summary:
+{summary}
+
+New exchanges:
+{exchanges}"""
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English; close enough for a budget.
+    return len(text) // 4 + 1
+
 
 class ChatBot:
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY")
-        self.model = "llama-3.3-70b-versatile"
+        self.router = router
+        # Preferred chat model; the router may pick a faster one per request.
+        self.model = self.router.primary("chat")
         self.client = Groq(api_key=self.api_key)
+        self.timeout = float(os.getenv("CHAT_TIMEOUT", "20"))
+        self.cache = ProductCache(
+            path=os.getenv("CHAT_CACHE_PATH", os.path.join(os.getcwd(), "cache", "chat_responses.sqlite")),
+            max_entries=int(os.getenv("CHAT_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("CHAT_CACHE_TTL", str(24 * 3600))),
+            table="responses",
+        )
+        # Conversation memory: recent turns verbatim up to history_tokens, older
+        # ones folded into a summary of at most summary_tokens.
+        self.history_tokens = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+        self.summary_tokens = int(os.getenv("CHAT_SUMMARY_TOKENS", "200"))
+        # Summaries are written after the reply has gone out.
+        self.summary_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CHAT_SUMMARY_WORKERS", "2")),
+                                                   thread_name_prefix="chat-summary")
+
+    def cache_key(self, personal_info, product_info, user_question, request_class="chat"):
+        # Key on the rendered contexts rather than the raw dicts so fields the
+        # prompt ignores (image_url, raw model output, ...) don't split entries.
+        # Only the class's preferred model's answers are stored, so a fallback
+        # model's reply isn't served once the preferred one has recovered.
+        _, personal_context, product_context = self.build_context(personal_info, product_info)
+        question = " ".join(user_question.split()).lower()
+        key = "\0".join([self.router.primary(request_class), personal_context, product_context, question])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def build_context(self, personal_info, product_info):
+        system_context = (
+            "You are a helpful nutritional assistant that provides personalized recommendations "
+            "about food items based on personal information and user queries. "
+            "Keep responses concise (around 150 words). "
+            "Use markdown formatting: **bold** for important terms (nutrients, food names, allergens), "
+            "bullet points (-) for lists, and clear structure. "
+            "Never provide any links to images. "
+            "You are KenShoku AI.\n\n"
+        )
+
+        personal_context = ""
+        if personal_info and any(personal_info.values()):
+            personal_context = "Personal Information:\n"
+            if personal_info.get('name'):
+                personal_context += f"- Name: {personal_info.get('name')}\n"
+            if personal_info.get('age'):
+                personal_context += f"- Age: {personal_info.get('age')}\n"
+            if personal_info.get('gender'):
+                personal_context += f"- Gender: {personal_info.get('gender')}\n"
+            if personal_info.get('goals'):
+                personal_context += f"- Nutritional Goals: {personal_info.get('goals')}\n"
+            if personal_info.get('allergens'):
+                personal_context += f"- Allergies: {personal_info.get('allergens')}\n"
+            if personal_info.get('dietary'):
+                personal_context += f"- Dietary preference: {personal_info.get('dietary')}\n"
+            personal_context += "\n"
+
+        product_context = ""
+        if product_info and any(product_info.values()):
+            product_context = "Food Item Information:\n"
+            if product_info.get('product_name'):
+                product_context += f"- Food: {product_info.get('product_name')}\n"
+            if product_info.get('quantity'):
+                product_context += f"- Quantity: {product_info.get('quantity')}\n"
+            if product_info.get('calories'):
+                product_context += f"- Calories: {product_info.get('calories')}\n"
+            if product_info.get('allergens'):
+                product_context += f"- Allergens: {product_info.get('allergens')}\n"
+            if product_info.get('dietary'):
+                product_context += f"- Dietary type: {product_info.get('dietary')}\n"
+            product_context += "\n"
+
+        return system_context, personal_context, product_context
+
+    def build_messages(self, personal_info, product_info, user_question, conversation=None):
+        system_context, personal_context, product_context = self.build_context(personal_info, product_info)
+        user_query = f"User Question: {user_question}\n"
+
+        full_prompt = system_context + personal_context + product_context + user_query
+
+        print(f"Full prompt sent to Groq:\n{full_prompt}\n")
 
-    def get_response(self, personal_info, product_info, user_question):
+        # Profile and product go first and never change within a conversation,
+        # so every turn shares the same prompt prefix.
+        messages = [{"role": "system", "content": system_context + personal_context + product_context}]
+        conversation = conversation or {}
+        if conversation.get("summary"):
+            messages.append({"role": "system",
+                             "content": f"Summary of the earlier conversation:\n{conversation['summary']}"})
+        for question, answer in conversation.get("turns", []):
+            messages.append({"role": "user", "content": f"User Question: {question}\n"})
+            messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": user_query})
+        return messages
+
+    def remember(self, conversation, user_question, answer):
+        """Return (conversation with this turn added, oldest turns to fold).
+
+        Turns stay verbatim until they pass history_tokens. Then enough of the
+        oldest are picked to bring the history back to about half the budget,
+        so a summary is only needed every few turns. The caller summarizes
+        them off the request path and applies the result with fold().
+        """
+        conversation = conversation or {}
+        summary = conversation.get("summary", "")
+        turns = [list(turn) for turn in conversation.get("turns", [])] + [[user_question, answer]]
+
+        used = estimate_tokens(summary) + sum(estimate_tokens(q) + estimate_tokens(a) for q, a in turns)
+        folded = []
+        if used > self.history_tokens:
+            while used > self.history_tokens // 2 and len(turns) - len(folded) > 1:
+                question, reply = turns[len(folded)]
+                folded.append([question, reply])
+                used -= estimate_tokens(question) + estimate_tokens(reply)
+        return {"summary": summary, "turns": turns}, folded
+
+    def fold(self, conversation, folded, summary):
+        """conversation with folded replaced by summary, or None if it has moved on since."""
+        turns = [list(turn) for turn in (conversation or {}).get("turns", [])]
+        if not folded or turns[:len(folded)] != folded:
+            return None
+        return {"summary": summary, "turns": turns[len(folded):]}
+
+    def summarize(self, summary, turns, deadline=None):
+        exchanges = "\n".join(f"User: {question}\nKenShoku AI: {answer}" for question, answer in turns)
+        try:
+            response = self.router.call(
+                "summary",
+                self.client.chat.completions.create,
+                messages=[{"role": "user", "content": SUMMARY_PROMPT.format(summary=summary or "(none yet)",
+                                                                            exchanges=exchanges)}],
+                temperature=0.2,
+                max_tokens=self.summary_tokens,
+                deadline=deadline,
+                timeout=self.timeout,
+            )
+            updated = (response.choices[0].message.content or "").strip()
+            if updated:
+                print(f"Folded {len(turns)} chat turn(s) into the summary")
+                return updated
+        except Exception as e:
+            print(f"ChatBot summary error: {e}")
+
+        # Couldn't summarize: keep the questions, newest last, within the summary budget.
+        notes = " ".join(f"User asked: {question}" for question, _ in turns)
+        return f"{summary} {notes}".strip()[-self.summary_tokens * 4:]
+
+    def get_response(self, personal_info, product_info, user_question, deadline=None, request_class="chat",
+                     conversation=None):
+        """Return the answer, None if Groq is unavailable or out of time, or an 'Error: ...' string."""
         try:
             print(f"ChatBot received:")
             print(f"  Personal info: {personal_info}")
             print(f"  Product info: {product_info}")
             print(f"  Question: {user_question}")
 
-            system_context = (
-                "You are a helpful nutritional assistant that provides personalized recommendations "
-                "about food items based on personal information and user queries. "
-                "Keep responses concise (around 150 words). "
-                "Use markdown formatting: **bold** for important terms (nutrients, food names, allergens), "
-                "bullet points (-) for lists, and clear structure. "
-                "Never provide any links to images. "
-                "You are KenShoku AI.\n\n"
-            )
+            # Answers that depend on earlier turns aren't reusable.
+            key = None if conversation else self.cache_key(personal_info, product_info, user_question, request_class)
+            found, answer = self.cache.get(key) if key else (False, None)
+            if found:
+                print("ChatBot cache hit")
+                return answer
 
-            personal_context = ""
-            if personal_info and any(personal_info.values()):
-                personal_context = "Personal Information:\n"
-                if personal_info.get('name'):
-                    personal_context += f"- Name: {personal_info.get('name')}\n"
-                if personal_info.get('age'):
-                    personal_context += f"- Age: {personal_info.get('age')}\n"
-                if personal_info.get('gender'):
-                    personal_context += f"- Gender: {personal_info.get('gender')}\n"
-                if personal_info.get('goals'):
-                    personal_context += f"- Nutritional Goals: {personal_info.get('goals')}\n"
-                if personal_info.get('allergens'):
-                    personal_context += f"- Allergies: {personal_info.get('allergens')}\n"
-                if personal_info.get('dietary'):
-                    personal_context += f"- Dietary preference: {personal_info.get('dietary')}\n"
-                personal_context += "\n"
-
-            product_context = ""
-            if product_info and any(product_info.values()):
-                product_context = "Food Item Information:\n"
-                if product_info.get('product_name'):
-                    product_context += f"- Food: {product_info.get('product_name')}\n"
-                if product_info.get('quantity'):
-                    product_context += f"- Quantity: {product_info.get('quantity')}\n"
-                if product_info.get('calories'):
-                    product_context += f"- Calories: {product_info.get('calories')}\n"
-                if product_info.get('allergens'):
-                    product_context += f"- Allergens: {product_info.get('allergens')}\n"
-                if product_info.get('dietary'):
-                    product_context += f"- Dietary type: {product_info.get('dietary')}\n"
-                product_context += "\n"
-
-            user_query = f"User Question: {user_question}\n"
-
-            full_prompt = system_context + personal_context + product_context + user_query
-
-            print(f"Full prompt sent to Groq:\n{full_prompt}\n")
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_context},
-                    {"role": "user", "content": personal_context + product_context + user_query}
-                ],
+            model, response = self.router.route(
+                request_class,
+                self.client.chat.completions.create,
+                messages=self.build_messages(personal_info, product_info, user_question, conversation),
                 temperature=0.7,
                 max_tokens=250,
+                deadline=deadline,
+                timeout=self.timeout,
             )
 
-            return response.choices[0].message.content
+            answer = response.choices[0].message.content
+            if answer and key and model == self.router.primary(request_class):
+                self.cache.set(key, answer)
+            return answer
 
+        except UpstreamUnavailable as e:
+            print(f"ChatBot skipped: {e}")
+            return None
         except Exception as e:
             print(f"ChatBot error: {e}")
             import traceback
             traceback.print_exc()
             return f"Error: {e}"
 
+    def get_sections(self, personal_info, product_info, prompts, deadline=None):
+        """Answer several prompts with one JSON-mode call.
 
-chatbot = ChatBot()
+        prompts maps section name -> instructions. Returns {name: text} for
+        the sections the reply answered properly (possibly none), or None if
+        Groq is unavailable or out of time.
+        """
+        try:
+            key = self.cache_key(personal_info, product_info, json.dumps(prompts, sort_keys=True), "analysis")
+            found, answers = self.cache.get(key)
+            if found:
+                print("ChatBot cache hit (sections)")
+                return answers
+
+            system_context, personal_context, product_context = self.build_context(personal_info, product_info)
+            instructions = "\n\n".join(f'"{name}":\n{prompt}' for name, prompt in prompts.items())
+            model, response = self.router.route(
+                "analysis",
+                self.client.chat.completions.create,
+                messages=[
+                    {"role": "system", "content": system_context + (
+                        "Reply with a single JSON object and nothing else. Its keys are exactly: "
+                        + ", ".join(f'"{name}"' for name in prompts)
+                        + ". Each value is a markdown string following the instructions for that key."
+                    )},
+                    {"role": "user", "content": personal_context + product_context
+                        + "Instructions for each key:\n\n" + instructions},
+                ],
+                temperature=0.7,
+                max_tokens=300 * len(prompts),
+                response_format={"type": "json_object"},
+                deadline=deadline,
+                timeout=self.timeout,
+            )
+
+            answers = self.parse_sections(response.choices[0].message.content, prompts)
+            if len(answers) == len(prompts) and model == self.router.primary("analysis"):
+                self.cache.set(key, answers)
+            return answers
+
+        except UpstreamUnavailable as e:
+            print(f"ChatBot skipped: {e}")
+            return None
+        except Exception as e:
+            print(f"ChatBot sections error: {e}")
+            return {}
+
+    def parse_sections(self, text, prompts):
+        """Keep the non-empty string (or list of strings) values of the expected keys."""
+        text = (text or "").strip()
+        if text.startswith("```"):
+            text = text.strip("`").split("\n", 1)[-1]
+        try:
+            data = json.loads(text)
+        except ValueError:
+            print("ChatBot sections reply was not valid JSON")
+            return {}
+        if not isinstance(data, dict):
+            return {}
+
+        answers = {}
+        for name in prompts:
+            value = data.get(name)
+            if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+                value = "\n".join(f"- {item}" for item in value)
+            if isinstance(value, str) and value.strip():
+                answers[name] = value.strip()
+        return answers
+
+    def stream_response(self, personal_info, product_info, user_question, deadline=None, conversation=None):
+        """Yield the answer in chunks as Groq generates it."""
+        try:
+            print(f"ChatBot streaming question: {user_question}")
+
+            key = None if conversation else self.cache_key(personal_info, product_info, user_question)
+            found, answer = self.cache.get(key) if key else (False, None)
+            if found:
+                print("ChatBot cache hit")
+                yield answer
+                return
+
+            # Opening the stream returns with the first response bytes, so the
+            # router sees time to first token here.
+            model, stream = self.router.route(
+                "chat",
+                self.client.chat.completions.create,
+                messages=self.build_messages(personal_info, product_info, user_question, conversation),
+                temperature=0.7,
+                max_tokens=250,
+                stream=True,
+                deadline=deadline,
+                timeout=self.timeout,
+            )
+
+            parts = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+            if parts and key and model == self.router.primary("chat"):
+                self.cache.set(key, "".join(parts))
+
+        except UpstreamUnavailable as e:
+            print(f"ChatBot skipped: {e}")
+            yield UNAVAILABLE_MESSAGE
+        except Exception as e:
+            print(f"ChatBot error: {e}")
+            import traceback
+            traceback.print_exc()
+            yield f"Error: {e}"
@@ -1,28 +1,101 @@
 import base64
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+import cv2
+import numpy as np
+from allergens import dietary_type
 from dotenv import load_dotenv
 from groq import Groq
+from http_client import get_client
+from model_router import router
+from nutrition import parse_grams, to_number
+from phash_cache import PerceptualHashCache, dhash, distinctive
+from resilience import UpstreamUnavailable
+from usda_index import UsdaFoodIndex
 
 load_dotenv()
 
+# USDA nutrient values are per 100 g; portions the model didn't size count as this.
+DEFAULT_PORTION_GRAMS = 100
+PLATE_NUTRIENTS = ("calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium")
+
 
 class FoodRecognizer:
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY")
         self.client = Groq(api_key=self.api_key)
-        self.model = "meta-llama/llama-4-scout-17b-16e-instruct"  
+        self.router = router
+        # Preferred vision model; the router may pick another per request.
+        self.model = self.router.primary("vision")
+        # Longest a vision call may take, and its share of a request's remaining
+        # deadline; the USDA lookups that follow get what is left.
+        self.vision_timeout = float(os.getenv("VISION_TIMEOUT", "15"))
+        self.vision_deadline_share = float(os.getenv("VISION_DEADLINE_SHARE", "0.6"))
         
         self.usda_api_key = os.getenv(
             "USDA_API_KEY", "DEMO_KEY"
         )  
         self.usda_base_url = "https://api.nal.usda.gov/fdc/v1"
+        self.usda_remote_fallback = os.getenv("USDA_REMOTE_FALLBACK", "1") == "1"
+        self.usda_match_threshold = float(os.getenv("USDA_MATCH_THRESHOLD", "0.45"))
+        self.usda_http = get_client("usda", pool_size=int(os.getenv("FOOD_LOOKUP_WORKERS", "4")))
+
+        self.usda_index = None
+        usda_index_path = os.getenv(
+            "USDA_INDEX_PATH", os.path.join(os.getcwd(), "cache", "usda_foods.sqlite")
+        )
+        if os.path.exists(usda_index_path):
+            self.usda_index = UsdaFoodIndex(usda_index_path)
+
+        # Vision preprocessing: crop ("none", "center" or "saliency"), cap the
+        # longest edge and re-encode before the image is sent to Groq.
+        self.vision_max_edge = int(os.getenv("VISION_MAX_EDGE", "768"))
+        self.vision_jpeg_quality = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+        self.vision_crop = os.getenv("VISION_CROP", "center")
+        self.vision_crop_fraction = float(os.getenv("VISION_CROP_FRACTION", "0.9"))
+        self.image_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+        self.image_stats_lock = threading.Lock()
+
+        self.recent_images = PerceptualHashCache(
+            max_entries=int(os.getenv("FOOD_HASH_CACHE_SIZE", "256")),
+            threshold=int(os.getenv("FOOD_HASH_THRESHOLD", "6")),
+        )
+
+        # Each item on a plate is looked up against USDA in parallel.
+        self.lookup_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("FOOD_LOOKUP_WORKERS", "4")), thread_name_prefix="usda-lookup"
+        )
 
     def recognize_food(self, image_path):
         print(f"Recognizing food from image: {image_path}")
 
-        food_items = self.identify_food_with_gemini(image_path)
+        with open(image_path, "rb") as image_file:
+            return self.recognize_food_image(image_file.read())
+
+    def recognize_food_image(self, image, deadline=None):
+        frame, original = self.decode_upload(image)
+        if frame is None:
+            print("Could not decode food image")
+            return None
+
+        # The cache is shared by every session, so low-texture photos, which
+        # all hash alike, are never looked up or stored.
+        image_hash = dhash(frame)
+        if not distinctive(frame, image_hash):
+            image_hash = None
+        cached = self.recent_images.get(image_hash) if image_hash is not None else None
+        if cached is not None:
+            return cached
+
+        image_data = self.prepare_image(frame, original)
+        if image_data is None:
+            print("Could not encode food image")
+            return None
+
+        vision_deadline = deadline.split(self.vision_deadline_share) if deadline is not None else None
+        food_items = self.identify_food_with_gemini(image_data, vision_deadline)
 
         if not food_items:
             print("No food items identified")
@@ -30,14 +103,95 @@ class FoodRecognizer:
 
         print(f"Identified food items: {food_items}")
 
-        nutrition_data = self.get_nutrition_from_usda(food_items)
+        if len(food_items.get("items", [])) > 1:
+            nutrition_data = self.get_plate_nutrition(food_items, deadline)
+        else:
+            nutrition_data = self.get_nutrition_from_usda(food_items, deadline)
+
+        # Fallback responses usually mean USDA was unreachable; don't pin them.
+        if image_hash is not None and nutrition_data and "note" not in nutrition_data:
+            self.recent_images.set(image_hash, nutrition_data)
 
         return nutrition_data
 
-    def identify_food_with_gemini(self, image_path):
+    def decode_upload(self, image):
+        """Return (BGR frame, original encoded bytes or None) for a frame or upload."""
+        if isinstance(image, np.ndarray):
+            return image, None
+        original = bytes(image)
+        return cv2.imdecode(np.frombuffer(original, np.uint8), cv2.IMREAD_COLOR), original
+
+    def prepare_image(self, image, original=None):
+        """Crop, downscale and re-encode a food photo for the vision model."""
+        frame = self.crop_for_vision(image)
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.vision_max_edge / max(height, width))
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        ok, buffer = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.vision_jpeg_quality])
+        if not ok:
+            return None
+        image_data = buffer.tobytes()
+
+        # A small JPEG upload can already beat our re-encode; don't make it worse.
+        if original is not None and original[:3] == b"\xff\xd8\xff" and len(original) <= len(image_data) \
+                and self.vision_crop == "none" and scale == 1.0:
+            image_data = original
+
+        bytes_in = len(original) if original is not None else image.nbytes
+        with self.image_stats_lock:
+            self.image_stats["images"] += 1
+            self.image_stats["bytes_in"] += bytes_in
+            self.image_stats["bytes_out"] += len(image_data)
+        print(f"Vision image: {bytes_in} -> {len(image_data)} bytes "
+              f"({width}x{height} -> {frame.shape[1]}x{frame.shape[0]})")
+        return image_data
+
+    def crop_for_vision(self, frame):
+        height, width = frame.shape[:2]
+
+        if self.vision_crop == "center":
+            crop_w, crop_h = int(width * self.vision_crop_fraction), int(height * self.vision_crop_fraction)
+            left, top = (width - crop_w) // 2, (height - crop_h) // 2
+            return frame[top:top + crop_h, left:left + crop_w]
+
+        if self.vision_crop == "saliency":
+            # Cheap saliency: where edge energy is well above average on a
+            # thumbnail, which is usually the plate rather than the table.
+            scale = min(1.0, 128 / max(height, width))
+            gray = cv2.cvtColor(cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA),
+                                cv2.COLOR_BGR2GRAY)
+            energy = cv2.GaussianBlur(cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0),
+                                                    cv2.Sobel(gray, cv2.CV_32F, 0, 1)), (9, 9), 0)
+            ys, xs = np.nonzero(energy > energy.mean() + energy.std())
+            if len(xs) == 0:
+                return frame
+
+            left, right = xs.min() / scale, (xs.max() + 1) / scale
+            top, bottom = ys.min() / scale, (ys.max() + 1) / scale
+            # Pad the box and never crop below half of either dimension.
+            crop_w = min(width, max((right - left) * 1.2, width / 2))
+            crop_h = min(height, max((bottom - top) * 1.2, height / 2))
+            center_x, center_y = (left + right) / 2, (top + bottom) / 2
+            left = int(min(max(center_x - crop_w / 2, 0), width - crop_w))
+            top = int(min(max(center_y - crop_h / 2, 0), height - crop_h))
+            return frame[top:top + int(crop_h), left:left + int(crop_w)]
+
+        return frame
+
+    def image_stats_snapshot(self):
+        with self.image_stats_lock:
+            stats = dict(self.image_stats)
+        stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+        stats["ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else 0.0
+        return stats
+
+    def identify_food_with_gemini(self, image_data, deadline=None):
         try:
-            with open(image_path, "rb") as image_file:
-                image_data = image_file.read()
+            if isinstance(image_data, str):
+                with open(image_data, "rb") as image_file:
+                    image_data = image_file.read()
 
             prompt = """Analyze this food image and provide:
 1. The name of the food item(s) you see
@@ -56,8 +210,9 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
 
             base64_image = base64.b64encode(image_data).decode('utf-8')
 
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self.router.call(
+                "vision",
+                self.client.chat.completions.create,
                 messages=[
                     {
                         "role": "user",
@@ -74,6 +229,8 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
                 ],
                 temperature=0.4,
                 max_tokens=500,
+                deadline=deadline,
+                timeout=self.vision_timeout,
             )
 
             gemini_response = response.choices[0].message.content
@@ -83,6 +240,9 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
 
             return food_items
 
+        except UpstreamUnavailable as e:
+            print(f"Skipping Groq Vision recognition: {e}")
+            return None
         except Exception as e:
             print(f"Error in Groq Vision recognition: {e}")
             import traceback
@@ -92,26 +252,22 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
 
     def parse_gemini_response(self, response_text):
         try:
-            lines = response_text.strip().split("\n")
-            food_name = ""
-            quantity = ""
-            found_first = False
-
-            for line in lines:
-                line = line.strip()
+            items = []
+            for line in response_text.strip().split("\n"):
+                line = line.strip().lstrip("-*0123456789. ").replace("**", "")
                 if line.startswith("Food:"):
-                    if not found_first:
-                        food_name = line.replace("Food:", "").strip()
-                        found_first = True
-                elif line.startswith("Quantity:") and found_first and not quantity:
-                    quantity = line.replace("Quantity:", "").strip()
-                    break  
-
-            if food_name:
-                print(f"Parsed main food: {food_name} ({quantity})")
+                    items.append({"name": line.replace("Food:", "").strip(), "quantity": ""})
+                elif line.startswith("Quantity:") and items and not items[-1]["quantity"]:
+                    items[-1]["quantity"] = line.replace("Quantity:", "").strip()
+            items = [item for item in items if item["name"]]
+
+            if items:
+                for item in items:
+                    print(f"Parsed food: {item['name']} ({item['quantity']})")
                 return {
-                    "name": food_name,
-                    "quantity": quantity,
+                    "name": ", ".join(item["name"] for item in items),
+                    "quantity": "; ".join(item["quantity"] or "Unknown" for item in items),
+                    "items": items,
                     "raw_response": response_text,
                 }
 
@@ -126,11 +282,22 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
             print(f"Error parsing Gemini response: {e}")
             return None
 
-    def get_nutrition_from_usda(self, food_items):
+    def get_nutrition_from_usda(self, food_items, deadline=None):
         try:
             food_name = food_items["name"]
             quantity = food_items["quantity"]
 
+            if self.usda_index is not None:
+                matches = self.usda_index.search(food_name)
+                if matches and matches[0]["score"] >= self.usda_match_threshold:
+                    food = matches[0]
+                    print(f"Local USDA match for {food_name}: {food['description']} (score {food['score']})")
+                    return self.build_product_info(food["description"], food["nutrients"], food_items)
+                print(f"No confident local USDA match for: {food_name}")
+
+            if not self.usda_remote_fallback:
+                return self.create_fallback_response(food_name, quantity)
+
             print(f"Searching USDA database for: {food_name}")
 
             search_url = f"{self.usda_base_url}/foods/search"
@@ -141,7 +308,7 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
                 "dataType": ["Survey (FNDDS)", "Foundation", "SR Legacy"],
             }
 
-            response = requests.get(search_url, params=params, timeout=10)
+            response = self.usda_http.get(search_url, params=params, deadline=deadline, hedge=True)
             print(f"USDA API Response Status: {response.status_code}")
 
             if response.status_code != 200:
@@ -162,32 +329,11 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
                 nutrient_value = nutrient.get("value", "Not specified")
                 nutrients[nutrient_name] = nutrient_value
 
-            product_info = {
-                "product_name": food.get("description", food_name),
-                "image_url": "",  
-                "description": f"{food_name} - {quantity}",
-                "expiration_date": "Not applicable (fresh food)",
-                "calories": nutrients.get("Energy", "Not specified"),
-                "allergens": "Please check ingredients - common allergens may include dairy, nuts, soy, gluten",
-                "important_ingredients": food_name,
-                "dietary": self.determine_dietary_type(food_name),
-                "ingredients": food_name,
-                "protein": nutrients.get("Protein", "Not specified"),
-                "carbs": nutrients.get("Carbohydrate, by difference", "Not specified"),
-                "fat": nutrients.get("Total lipid (fat)", "Not specified"),
-                "fiber": nutrients.get("Fiber, total dietary", "Not specified"),
-                "sugar": nutrients.get("Sugars, total including NLEA", "Not specified"),
-                "sodium": nutrients.get("Sodium, Na", "Not specified"),
-                "quantity": quantity,
-                "source": "USDA FoodData Central",
-                "gemini_raw_response": food_items.get("raw_response", ""),
-            }
-
-            print(
-                f"Successfully retrieved nutrition data for: {product_info['product_name']}"
-            )
-            return product_info
+            return self.build_product_info(food.get("description", food_name), nutrients, food_items)
 
+        except UpstreamUnavailable as e:
+            print(f"Skipping USDA lookup: {e}")
+            return self.create_fallback_response(food_items["name"], food_items["quantity"])
         except Exception as e:
             print(f"Error fetching USDA data: {e}")
             import traceback
@@ -197,31 +343,95 @@ Be specific (e.g., "grilled chicken breast" not just "chicken").
                 food_items["name"], food_items["quantity"]
             )
 
-    def determine_dietary_type(self, food_name):
-        food_lower = food_name.lower()
-
-        meat_keywords = [
-            "chicken",
-            "beef",
-            "pork",
-            "fish",
-            "meat",
-            "lamb",
-            "turkey",
-            "bacon",
-            "ham",
+    def build_product_info(self, description, nutrients, food_items):
+        food_name = food_items["name"]
+        quantity = food_items["quantity"]
+
+        product_info = {
+            "product_name": description or food_name,
+            "image_url": "",  
+            "description": f"{food_name} - {quantity}",
+            "expiration_date": "Not applicable (fresh food)",
+            "calories": nutrients.get("Energy", "Not specified"),
+            "allergens": "Please check ingredients - common allergens may include dairy, nuts, soy, gluten",
+            "important_ingredients": food_name,
+            "dietary": self.determine_dietary_type(food_name),
+            "ingredients": food_name,
+            "protein": nutrients.get("Protein", "Not specified"),
+            "carbs": nutrients.get("Carbohydrate, by difference", "Not specified"),
+            "fat": nutrients.get("Total lipid (fat)", "Not specified"),
+            "fiber": nutrients.get("Fiber, total dietary", "Not specified"),
+            "sugar": nutrients.get("Sugars, total including NLEA", "Not specified"),
+            "sodium": nutrients.get("Sodium, Na", "Not specified"),
+            "quantity": quantity,
+            "source": "USDA FoodData Central",
+            "gemini_raw_response": food_items.get("raw_response", ""),
+        }
+
+        print(
+            f"Successfully retrieved nutrition data for: {product_info['product_name']}"
+        )
+        return product_info
+
+    def get_plate_nutrition(self, food_items, deadline=None):
+        """Look up every item on the plate concurrently and total them by estimated weight."""
+        futures = [
+            self.lookup_executor.submit(
+                self.get_nutrition_from_usda, dict(item, raw_response=food_items.get("raw_response", "")), deadline
+            )
+            for item in food_items["items"]
         ]
-        dairy_keywords = ["cheese", "milk", "yogurt", "butter", "cream"]
+        results = [future.result() for future in futures]
+
+        breakdown = []
+        totals = dict.fromkeys(PLATE_NUTRIENTS)
+        total_grams = 0.0
+        estimated = False
+        for item, info in zip(food_items["items"], results):
+            grams = parse_grams(item["quantity"])
+            if grams is None:
+                grams, estimated = DEFAULT_PORTION_GRAMS, True
+            total_grams += grams
+
+            entry = {"name": item["name"], "match": info["product_name"], "quantity": item["quantity"],
+                     "grams": round(grams, 1), "source": info["source"]}
+            for key in PLATE_NUTRIENTS:
+                value = to_number(info.get(key))
+                entry[key] = round(value * grams / 100, 1) if value is not None else None
+                if entry[key] is not None:
+                    totals[key] = (totals[key] or 0.0) + entry[key]
+            breakdown.append(entry)
+
+        names = [item["name"] for item in food_items["items"]]
+        product_info = {
+            "product_name": ", ".join(names),
+            "image_url": "",
+            "description": "; ".join(f"{entry['name']} - {entry['quantity'] or 'Unknown'}" for entry in breakdown),
+            "expiration_date": "Not applicable (fresh food)",
+            "allergens": "Please check ingredients - common allergens may include dairy, nuts, soy, gluten",
+            "important_ingredients": ", ".join(names),
+            "dietary": self.determine_dietary_type(" ".join(names)),
+            "ingredients": ", ".join(names),
+            "quantity": f"{round(total_grams)} g total (estimated)",
+            "source": "USDA FoodData Central",
+            "items": breakdown,
+            "gemini_raw_response": food_items.get("raw_response", ""),
+        }
+        # Totals cover the whole plate, not 100 g.
+        product_info.update({key: round(value, 1) if value is not None else "Not specified"
+                             for key, value in totals.items()})
 
-        is_meat = any(keyword in food_lower for keyword in meat_keywords)
-        is_dairy = any(keyword in food_lower for keyword in dairy_keywords)
+        missing = [entry["name"] for entry in breakdown if entry["calories"] is None]
+        if missing:
+            product_info["note"] = f"Totals are approximate; no nutrition data for {', '.join(missing)}."
+        if estimated:
+            product_info["quantity"] += f"; unsized items counted as {DEFAULT_PORTION_GRAMS} g"
 
-        if is_meat:
-            return "Non-Vegetarian"
-        elif is_dairy:
-            return "Vegetarian"
-        else:
-            return "Likely Vegan (please verify ingredients)"
+        print(f"Plate totals for {len(breakdown)} items: {product_info['calories']} kcal, {round(total_grams)} g")
+        return product_info
+
+    def determine_dietary_type(self, food_name):
+        return dietary_type(food_name)
 
     def create_fallback_response(self, food_name, quantity):
         return {
@@ -0,0 +1,149 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from resilience import UpstreamUnavailable, deadline_timeout, get_breaker
+
+load_dotenv()
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.25"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+# A hedged GET sends a second copy if the first hasn't answered after this many seconds.
+HEDGE_AFTER = float(os.getenv("HTTP_HEDGE_AFTER", "1.0"))
+# Worth another try: rate limiting and transient upstream/gateway failures.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class HttpClient:
+    """Keep-alive session to one upstream with a bounded pool and GET retries.
+
+    Connections are reused across requests, so the TCP and TLS handshake is
+    paid once per pooled connection rather than once per lookup. At most
+    pool_size connections are opened; extra callers wait for a free one.
+    Only GET goes through here, so retrying and hedging are always safe.
+    Calls share the upstream's circuit breaker and, when given one, stay
+    within the caller's Deadline.
+    """
+
+    def __init__(self, name, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=RETRIES, backoff=RETRY_BACKOFF, hedge_after=HEDGE_AFTER):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.breaker = get_breaker(name)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.counters = {"requests": 0, "retries": 0, "hedges": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, deadline=None, hedge=False, **kwargs):
+        """GET through the circuit breaker, hedged if asked and within deadline.
+
+        Raises CircuitOpenError without sending anything while the upstream
+        is marked unhealthy, and DeadlineExceeded once the budget is spent.
+        """
+        deadline_timeout(deadline)
+        self.breaker.check()
+        try:
+            if hedge and self.hedge_after:
+                response = self._hedged_get(url, params, deadline, **kwargs)
+            else:
+                response = self._get(url, params, deadline, **kwargs)
+        except UpstreamUnavailable:
+            # Our own request budget ran out; the upstream did nothing wrong.
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if response.status_code in RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _get(self, url, params, deadline, **kwargs):
+        """GET with jittered exponential backoff on connection errors, timeouts and RETRY_STATUSES."""
+        for attempt in range(self.retries + 1):
+            connect_timeout, read_timeout = self.timeout
+            timeout = (deadline_timeout(deadline, connect_timeout), deadline_timeout(deadline, read_timeout))
+            self._count("requests" if attempt == 0 else "retries")
+            # Full jitter keeps workers that failed together from retrying together.
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            last = attempt == self.retries or (deadline is not None and deadline.remaining() < delay)
+            try:
+                response = self.session.get(url, params=params, timeout=timeout, **kwargs)
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+                print(f"{self.name}: HTTP {response.status_code}, retrying")
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if last:
+                    self._count("errors")
+                    raise
+                print(f"{self.name}: {type(e).__name__}, retrying")
+            time.sleep(delay)
+
+    def _hedged_get(self, url, params, deadline, **kwargs):
+        """Send a second copy if the first is slower than hedge_after; keep whichever answers first."""
+        futures = [hedge_executor.submit(self._get, url, params, deadline, **kwargs)]
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done and (deadline is None or deadline.remaining() > self.hedge_after):
+            self._count("hedges")
+            futures.append(hedge_executor.submit(self._get, url, params, deadline, **kwargs))
+
+        while True:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if not futures:
+                    return future.result()
+                if future.exception() is None and future.result().status_code not in RETRY_STATUSES:
+                    # The slower copy finishes in the background; give its connection back.
+                    futures[0].add_done_callback(close_response)
+                    return future.result()
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+# Runs hedged GETs so both copies can be in flight while the caller waits.
+hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HTTP_HEDGE_WORKERS", "16")),
+                                    thread_name_prefix="http-hedge")
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(name, **kwargs):
+    """Return this process's client for an upstream, creating it on first use."""
+    with clients_lock:
+        if name not in clients:
+            clients[name] = HttpClient(name, **kwargs)
+        return clients[name]
+
+
+def client_stats():
+    with clients_lock:
+        return {name: client.stats() for name, client in clients.items()}
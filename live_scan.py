@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+from pyzbar.pyzbar import decode
+
+
+class LiveBarcodeScanner:
+    """Decode barcodes continuously from a CameraStream.
+
+    A single worker thread samples every stride-th frame, decodes a
+    downscaled grayscale crop of the centre of the image and publishes each
+    new barcode to every listener. The same code read on consecutive
+    samples is reported once until it has been out of view for
+    dedupe_seconds.
+    """
+
+    def __init__(self, camera, stride=5, scale=0.5, roi=0.7, dedupe_seconds=3.0):
+        self.camera = camera
+        self.stride = max(1, stride)
+        self.scale = scale
+        self.roi = roi
+        self.dedupe_seconds = dedupe_seconds
+        self.detections = deque(maxlen=16)
+        self.seq = 0
+        self.listeners = 0
+        self.running = False
+        self.thread = None
+        self.condition = threading.Condition()
+
+    def events(self, keepalive=15.0):
+        """Yield each newly detected barcode, or None every keepalive seconds."""
+        with self.condition:
+            self.listeners += 1
+            last_seen = self.seq
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name="live-barcode", daemon=True)
+                self.thread.start()
+
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.seq > last_seen or not self.running, timeout=keepalive)
+                    new = [barcode for seq, barcode in self.detections if seq > last_seen]
+                    last_seen = self.seq
+                    running = self.running
+                if not new:
+                    if not running:
+                        return
+                    yield None
+                for barcode in new:
+                    yield barcode
+        finally:
+            with self.condition:
+                self.listeners -= 1
+
+    def decode_frame(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height, width = gray.shape[:2]
+        crop_h, crop_w = int(height * self.roi), int(width * self.roi)
+        top, left = (height - crop_h) // 2, (width - crop_w) // 2
+        region = gray[top:top + crop_h, left:left + crop_w]
+        if self.scale != 1.0:
+            region = cv2.resize(region, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return [barcode.data.decode("utf-8") for barcode in decode(region)]
+
+    def _run(self):
+        last_sampled = 0
+        last_barcode, last_read_at = None, 0.0
+        frames = self.camera.frames(raw=True)
+        print("Live barcode scanning started")
+
+        try:
+            for seq, frame in frames:
+                with self.condition:
+                    if self.listeners == 0:
+                        self.running = False
+                        break
+                if seq - last_sampled < self.stride:
+                    continue
+                last_sampled = seq
+
+                now = time.time()
+                for barcode in self.decode_frame(frame):
+                    repeated = barcode == last_barcode and now - last_read_at < self.dedupe_seconds
+                    last_barcode, last_read_at = barcode, now
+                    if repeated:
+                        continue
+                    print(f"Live scan detected barcode: {barcode}")
+                    with self.condition:
+                        self.seq += 1
+                        self.detections.append((self.seq, barcode))
+                        self.condition.notify_all()
+        finally:
+            frames.close()
+            with self.condition:
+                if threading.current_thread() is self.thread:
+                    self.running = False
+                self.condition.notify_all()
+            print("Live barcode scanning stopped")
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+from resilience import CircuitOpenError, DeadlineExceeded, deadline_timeout, get_breaker
+
+load_dotenv()
+
+# Request class -> models to try, preferred first. The last one should be the
+# fastest: it is what a degraded primary or a tight deadline falls back to.
+DEFAULT_ROUTES = {
+    "chat": "llama-3.3-70b-versatile,llama-3.1-8b-instant",
+    "analysis": "llama-3.3-70b-versatile,llama-3.1-8b-instant",
+    "vision": "meta-llama/llama-4-scout-17b-16e-instruct,meta-llama/llama-4-maverick-17b-128e-instruct",
+    "summary": "llama-3.1-8b-instant",
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ModelRouter:
+    """Choose a Groq model per request class from recent latency and errors.
+
+    Every call's latency and outcome is kept for window seconds per model.
+    A model is degraded when, over at least min_samples calls, its error rate
+    reaches max_error_rate or its p95 latency exceeds slow_p95. choose()
+    returns the first healthy model for the class whose p95 also fits in the
+    caller's remaining deadline, and otherwise the fastest one. Old samples
+    age out, so a degraded primary is tried again once the window has passed.
+    """
+
+    def __init__(self, routes, window=120.0, min_samples=5, max_error_rate=0.25, slow_p95=8.0, retries=1):
+        self.routes = routes
+        self.retries = retries
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.slow_p95 = slow_p95
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def primary(self, request_class):
+        return self.routes[request_class][0]
+
+    def record(self, model, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(model, deque(maxlen=500)).append((time.monotonic(), seconds, ok))
+
+    def timed(self, model, fn, *args, **kwargs):
+        """Call fn(*args, model=model, **kwargs) and record how it went."""
+        started = time.monotonic()
+        try:
+            result = fn(*args, model=model, **kwargs)
+        except Exception:
+            self.record(model, time.monotonic() - started, False)
+            raise
+        self.record(model, time.monotonic() - started, True)
+        return result
+
+    def call(self, request_class, fn, *args, deadline=None, timeout=None, **kwargs):
+        """fn's result from route(), for callers that don't care which model answered."""
+        return self.route(request_class, fn, *args, deadline=deadline, timeout=timeout, **kwargs)[1]
+
+    def route(self, request_class, fn, *args, deadline=None, timeout=None, **kwargs):
+        """Return (model, fn(*args, model=model, **kwargs)), falling back to the next model on failure.
+
+        Each model has its own circuit breaker, so a degraded primary fails
+        fast without taking its fallbacks down with it. A model whose circuit
+        is open is skipped; a failed call is retried up to retries times on
+        the next candidate, each within what is left of the deadline. Raises
+        CircuitOpenError if every circuit is open, else the last error.
+        """
+        chosen = self.choose(request_class, deadline)
+        candidates = [chosen] + [model for model in self.routes[request_class] if model != chosen]
+        error, failures = None, 0
+        for model in candidates:
+            try:
+                return model, get_breaker(f"groq:{model}").call(
+                    self.timed, model, fn, *args, timeout=deadline_timeout(deadline, timeout), **kwargs)
+            except CircuitOpenError as e:
+                error = error or e
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                error = e
+                failures += 1
+                if failures > self.retries:
+                    break
+                print(f"{model} failed for {request_class} ({type(e).__name__}); trying the next model")
+        raise error
+
+    def health(self, model):
+        """(samples, p50, p95, error rate) over the window; latencies only count successes."""
+        cutoff = time.monotonic() - self.window
+        with self.lock:
+            samples = self.samples.get(model, ())
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            recent = list(samples)
+        latencies = [seconds for _, seconds, ok in recent if ok]
+        errors = sum(1 for _, _, ok in recent if not ok)
+        if not latencies:
+            return len(recent), None, None, errors / len(recent) if recent else 0.0
+        return len(recent), percentile(latencies, 0.5), percentile(latencies, 0.95), errors / len(recent)
+
+    def choose(self, request_class, deadline=None):
+        candidates = self.routes[request_class]
+        remaining = deadline.remaining() if deadline is not None else None
+        fallback, fallback_p95 = candidates[-1], None
+
+        for model in candidates:
+            count, _, p95, error_rate = self.health(model)
+            if count < self.min_samples:
+                # Not enough recent data to judge: assume it's fine.
+                return model
+            if error_rate >= self.max_error_rate:
+                continue
+            if p95 is not None and (fallback_p95 is None or p95 < fallback_p95):
+                fallback, fallback_p95 = model, p95
+            if p95 is not None and (p95 > self.slow_p95 or (remaining is not None and p95 > remaining)):
+                continue
+            return model
+
+        if fallback != candidates[0]:
+            print(f"Routing {request_class} to {fallback}: preferred models degraded or too slow")
+        return fallback
+
+    def stats(self):
+        with self.lock:
+            models = list(self.samples)
+        stats = {}
+        for model in models:
+            count, p50, p95, error_rate = self.health(model)
+            stats[model] = {
+                "samples": count,
+                "p50_ms": round(p50 * 1000) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000) if p95 is not None else None,
+                "error_rate": round(error_rate, 3),
+            }
+        return stats
+
+
+def load_routes():
+    return {
+        request_class: [model.strip() for model in os.getenv(f"{request_class.upper()}_MODELS", default).split(",")
+                        if model.strip()]
+        for request_class, default in DEFAULT_ROUTES.items()
+    }
+
+
+router = ModelRouter(
+    load_routes(),
+    window=float(os.getenv("ROUTER_WINDOW", "120")),
+    min_samples=int(os.getenv("ROUTER_MIN_SAMPLES", "5")),
+    max_error_rate=float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.25")),
+    slow_p95=float(os.getenv("ROUTER_SLOW_P95", "8")),
+    retries=int(os.getenv("ROUTER_RETRIES", "1")),
+)
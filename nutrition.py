@@ -0,0 +1,147 @@
+import re
+
+# FDA daily values for adults on a 2,000 kcal diet (sodium in mg, the rest in g).
+DAILY_VALUES = {
+    "calories": 2000, "protein": 50, "carbs": 275, "fat": 78, "saturated_fat": 20,
+    "fiber": 28, "sugar": 50, "sodium": 2300,
+}
+
+# Per-100 g (low, high) thresholds from the UK front-of-pack traffic lights;
+# fiber and protein use the EU "source of"/"high in" claim levels instead.
+THRESHOLDS = {
+    "fat": (3, 17.5), "saturated_fat": (1.5, 5), "sugar": (5, 22.5), "sodium": (120, 600), "fiber": (3, 6),
+}
+
+NUTRIENTS = [
+    ("protein", "Protein", "g"), ("carbs", "Carbs", "g"), ("fat", "Fat", "g"),
+    ("saturated_fat", "Saturated fat", "g"), ("fiber", "Fiber", "g"), ("sugar", "Sugars", "g"),
+    ("sodium", "Sodium", "mg"),
+]
+
+# Open Food Facts nutriments keys; sodium is converted from g to mg.
+OFF_NUTRIMENTS = {
+    "calories": "energy-kcal_100g", "protein": "proteins_100g", "carbs": "carbohydrates_100g",
+    "fat": "fat_100g", "saturated_fat": "saturated-fat_100g", "fiber": "fiber_100g",
+    "sugar": "sugars_100g", "sodium": "sodium_100g",
+}
+
+GRAMS_RANGE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:-|–|to)\s*(\d+(?:\.\d+)?)\s*(kg|g|grams?)\b", re.IGNORECASE)
+GRAMS_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(kg|g|grams?)\b", re.IGNORECASE)
+
+
+def parse_grams(quantity):
+    """Pull an estimated weight in grams out of text like '150-200 g' or '1 cup (240g)'."""
+    if not quantity:
+        return None
+    match = GRAMS_RANGE_RE.search(quantity)
+    if match:
+        grams = (float(match.group(1)) + float(match.group(2))) / 2
+    else:
+        match = GRAMS_RE.search(quantity)
+        if not match:
+            return None
+        grams = float(match.group(1))
+    return grams * 1000 if match.group(match.lastindex).lower() == "kg" else grams
+
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def nutrition_facts(product_info):
+    """Normalize a scanned product or recognized food into per-100 g values plus a portion.
+
+    Returns (per_100g, portion_grams, portion_label) or None when there are
+    no usable numbers. Barcode products use Open Food Facts nutriments and
+    the serving size; recognized foods use the USDA values and the vision
+    model's gram estimate; multi-item plates use their totals.
+    """
+    nutriments = product_info.get("nutriments")
+    if nutriments:
+        per_100g = {key: to_number(nutriments.get(field)) for key, field in OFF_NUTRIMENTS.items()}
+        if per_100g["calories"] is None and to_number(nutriments.get("energy_100g")) is not None:
+            per_100g["calories"] = to_number(nutriments["energy_100g"]) / 4.184
+        if per_100g["sodium"] is not None:
+            per_100g["sodium"] *= 1000
+        elif to_number(nutriments.get("salt_100g")) is not None:
+            per_100g["sodium"] = to_number(nutriments["salt_100g"]) / 2.5 * 1000
+        grams = to_number(product_info.get("serving_quantity")) or parse_grams(product_info.get("serving_size"))
+        label = "serving"
+    else:
+        values = {key: to_number(product_info.get(key)) for key in ("calories", "protein", "carbs", "fat",
+                                                                    "fiber", "sugar", "sodium")}
+        values["saturated_fat"] = None
+        if product_info.get("items"):
+            # Plate totals: derive per-100 g values from the summed item weights.
+            grams = sum(item.get("grams") or 0 for item in product_info["items"])
+            per_100g = {key: value * 100 / grams if value is not None and grams else None
+                        for key, value in values.items()}
+            label = "plate"
+        else:
+            per_100g = values
+            grams = parse_grams(product_info.get("quantity"))
+            label = "estimated portion"
+
+    if per_100g.get("calories") is None and all(per_100g.get(key) is None for key, _, _ in NUTRIENTS):
+        return None
+    return per_100g, grams, label
+
+
+def nutrient_flags(per_100g):
+    high, low = [], []
+    for key, label, _ in NUTRIENTS:
+        value = per_100g.get(key)
+        if value is None or key not in THRESHOLDS:
+            continue
+        low_limit, high_limit = THRESHOLDS[key]
+        if value > high_limit:
+            high.append(label.lower())
+        elif value <= low_limit:
+            low.append(label.lower())
+    calories, protein = per_100g.get("calories"), per_100g.get("protein")
+    if calories and protein is not None and protein * 4 >= 0.2 * calories:
+        high.append("protein")
+    return high, low
+
+
+def format_amount(value, unit):
+    return f"{value:.0f} {unit}" if value >= 10 or unit == "mg" else f"{value:.1f} {unit}"
+
+
+def nutrition_report(product_info):
+    """Markdown macro and calorie breakdown for /product, or None without numbers."""
+    facts = nutrition_facts(product_info)
+    if facts is None:
+        return None
+    per_100g, grams, portion_label = facts
+    scale = grams / 100 if grams else None
+
+    def line(value, unit, key):
+        text = f"{format_amount(value, unit)} per 100 g"
+        if scale:
+            portion = value * scale
+            text += f" · {format_amount(portion, unit)} per {portion_label}"
+            text += f" ({portion / DAILY_VALUES[key] * 100:.0f}% DV)"
+        else:
+            text += f" ({value / DAILY_VALUES[key] * 100:.0f}% DV)"
+        return text
+
+    lines = []
+    if per_100g.get("calories") is not None:
+        lines.append(f"**Calories**: **{line(per_100g['calories'], 'kcal', 'calories')}**")
+    if scale:
+        lines.append(f"- **Portion**: {grams:.0f} g ({portion_label})")
+    for key, label, unit in NUTRIENTS:
+        if per_100g.get(key) is not None:
+            lines.append(f"- **{label}**: {line(per_100g[key], unit, key)}")
+
+    high, low = nutrient_flags(per_100g)
+    if high:
+        lines.append(f"- High in: **{', '.join(high)}**")
+    if low:
+        lines.append(f"- Low in: **{', '.join(low)}**")
+    lines.append("- %DV is based on a 2,000 kcal daily diet")
+    return "\n".join(lines)
@@ -0,0 +1,185 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# Only the fields BarcodeScanner.parse_product reads are kept, which shrinks
+# the multi-GB export down to a few hundred bytes per product.
+KEPT_FIELDS = ["product_name", "image_url", "generic_name", "expiration_date",
+               "allergens_tags", "traces_tags", "labels_tags", "ingredients_text",
+               "serving_size", "serving_quantity"]
+NUTRIMENT_FIELDS = ["energy-kcal_100g", "energy_100g", "proteins_100g", "carbohydrates_100g", "fat_100g",
+                    "saturated-fat_100g", "fiber_100g", "sugars_100g", "sodium_100g", "salt_100g"]
+
+
+def slim_product(data):
+    product = {field: data[field] for field in KEPT_FIELDS if data.get(field)}
+
+    nutriments = data.get("nutriments") or {}
+    nutriments = {field: nutriments[field] for field in NUTRIMENT_FIELDS if nutriments.get(field) not in (None, "")}
+    if nutriments:
+        product["nutriments"] = nutriments
+
+    ingredients = [
+        {"text": ingredient["text"], "percent_estimate": ingredient["percent_estimate"]}
+        for ingredient in data.get("ingredients") or []
+        if ingredient.get("text") and (ingredient.get("percent_estimate") or 0) > 5
+    ]
+    if ingredients:
+        product["ingredients"] = ingredients
+
+    return product
+
+
+def csv_row_to_product(row):
+    """Map a row of the tab-separated CSV export onto the JSON field names."""
+    data = {field: row.get(field, "") for field in ["product_name", "image_url", "generic_name",
+                                                    "expiration_date", "ingredients_text", "serving_size"]}
+    for field, column in [("allergens_tags", "allergens"), ("traces_tags", "traces_tags"),
+                          ("labels_tags", "labels_tags")]:
+        value = row.get(column) or ""
+        data[field] = [tag for tag in value.split(",") if tag]
+    nutriments = {}
+    for field in NUTRIMENT_FIELDS + ["serving_quantity"]:
+        try:
+            nutriments[field] = float(row[field])
+        except (KeyError, TypeError, ValueError):
+            pass
+    if "serving_quantity" in nutriments:
+        data["serving_quantity"] = nutriments.pop("serving_quantity")
+    if nutriments:
+        data["nutriments"] = nutriments
+    return data
+
+
+def open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def read_dump(path):
+    """Yield (code, last_modified_t, product) from a JSONL or CSV export."""
+    with open_dump(path) as handle:
+        if ".csv" in os.path.basename(path):
+            csv.field_size_limit(sys.maxsize)
+            for row in csv.DictReader(handle, delimiter="\t"):
+                yield row.get("code"), row.get("last_modified_t"), csv_row_to_product(row)
+        else:
+            for line in handle:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                yield data.get("code") or data.get("_id"), data.get("last_modified_t"), data
+
+
+class OpenFoodFactsIndex:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            "code TEXT PRIMARY KEY, last_modified INTEGER NOT NULL, data TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def get(self, barcode):
+        candidates = [barcode]
+        if barcode.isdigit():
+            # The dump mixes UPC-A and zero-padded EAN-13 forms of the same code.
+            candidates += [barcode.zfill(13), barcode.lstrip("0")]
+
+        with self.lock:
+            for code in candidates:
+                row = self.db.execute("SELECT data FROM products WHERE code = ?", (code,)).fetchone()
+                if row is not None:
+                    return json.loads(row[0])
+        return None
+
+    def watermark(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'last_modified'").fetchone()
+        return int(row[0]) if row else 0
+
+    def import_dump(self, path, full=False, batch_size=5000):
+        """Stream an export into the index.
+
+        Unless full is set, rows not modified since the previous import are
+        skipped before they are serialized, and rows older than what is
+        already stored never overwrite it, so a refresh from a new dump only
+        pays for the products that changed.
+        """
+        since = 0 if full else self.watermark()
+        newest = since
+        stats = {"read": 0, "written": 0, "skipped": 0}
+        started = time.time()
+        batch = []
+
+        with self.lock:
+            self.db.execute("PRAGMA synchronous=OFF")
+            try:
+                for code, last_modified, data in read_dump(path):
+                    stats["read"] += 1
+                    try:
+                        last_modified = int(last_modified or 0)
+                    except ValueError:
+                        last_modified = 0
+                    if not code or (since and last_modified and last_modified <= since):
+                        stats["skipped"] += 1
+                        continue
+
+                    newest = max(newest, last_modified)
+                    batch.append((code, last_modified, json.dumps(slim_product(data), separators=(",", ":"))))
+                    if len(batch) >= batch_size:
+                        stats["written"] += self._write_batch(batch)
+                        batch = []
+                        print(f"Imported {stats['read']} rows ({stats['written']} written)")
+
+                if batch:
+                    stats["written"] += self._write_batch(batch)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_modified', ?)", (str(newest),)
+                )
+                self.db.commit()
+            finally:
+                self.db.execute("PRAGMA synchronous=NORMAL")
+
+        stats["seconds"] = round(time.time() - started, 1)
+        return stats
+
+    def _write_batch(self, batch):
+        before = self.db.total_changes
+        self.db.executemany(
+            "INSERT INTO products (code, last_modified, data) VALUES (?, ?, ?) "
+            "ON CONFLICT(code) DO UPDATE SET last_modified = excluded.last_modified, data = excluded.data "
+            "WHERE excluded.last_modified >= products.last_modified",
+            batch,
+        )
+        self.db.commit()
+        return self.db.total_changes - before
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline Open Food Facts index from a bulk export.")
+    parser.add_argument("dump", help="Path to the JSONL or CSV export (optionally .gz)")
+    parser.add_argument("--index", default=os.getenv("OFF_INDEX_PATH", os.path.join(os.getcwd(), "cache", "off_index.sqlite")))
+    parser.add_argument("--full", action="store_true", help="Re-import every row, ignoring the last import watermark")
+    args = parser.parse_args()
+
+    index = OpenFoodFactsIndex(args.index)
+    print(f"Import finished: {index.import_dump(args.dump, full=args.full)}")
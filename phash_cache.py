@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+
+
+def dhash(frame, size=8):
+    """64-bit difference hash: robust to rescaling, recompression and small shifts."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    value = 0
+    for bit in (small[:, 1:] > small[:, :-1]).flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def distinctive(frame, image_hash, size=8, min_bits=8, min_stddev=10.0):
+    """Whether image_hash says enough about frame to match it against other images.
+
+    Flat, dark or blown-out frames hash to (nearly) all zero or all one bits,
+    so any two of them would look like the same photo.
+    """
+    bits = bin(image_hash).count("1")
+    if bits < min_bits or bits > size * size - min_bits:
+        return False
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return float(gray.std()) >= min_stddev
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class PerceptualHashCache:
+    """Bounded LRU of recent image hashes -> results, matched by Hamming distance.
+
+    The cache is small (hundreds of entries), so a linear scan is cheaper
+    than maintaining a BK-tree and keeps eviction trivial.
+    """
+
+    def __init__(self, max_entries=256, threshold=6):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, image_hash):
+        with self.lock:
+            best, best_distance = None, self.threshold + 1
+            for key in self.entries:
+                distance = hamming(key, image_hash)
+                if distance < best_distance:
+                    best, best_distance = key, distance
+            if best is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(best)
+            self.counters["hits"] += 1
+            print(f"Near-duplicate image (distance {best_distance}), reusing previous recognition")
+            return dict(self.entries[best])
+
+    def set(self, image_hash, value):
+        with self.lock:
+            self.entries[image_hash] = dict(value)
+            self.entries.move_to_end(image_hash)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, entries=len(self.entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def copy_value(value):
+    # Callers mutate the dicts they get back (e.g. scanned_data), so hand out copies.
+    return dict(value) if isinstance(value, dict) else value
+
+
+class ProductCache:
+    """Two-tier cache for upstream lookups (barcode -> product_info by default).
+
+    A bounded in-process LRU sits in front of a SQLite file so lookups
+    survive restarts and are shared by every worker on the host. Expired
+    rows are kept on disk so they can still be served when the upstream
+    API is down (see get_stale). Values must be JSON-serializable.
+    """
+
+    def __init__(self, path=None, max_entries=2048, ttl=7 * 24 * 3600, negative_ttl=24 * 3600,
+                 table="products"):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "stale_served": 0,
+            "writes": 0,
+        }
+
+        self.db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.commit()
+
+    def get(self, key):
+        """Return (found, product_info). A negative entry is found with {}."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] > now:
+                self.memory.move_to_end(key)
+                self._count_hit("memory_hits", entry[1])
+                return True, copy_value(entry[1])
+
+            row = self._read_disk(key)
+            if row is not None and row[0] > now:
+                self._remember(key, row[0], row[1])
+                self._count_hit("disk_hits", row[1])
+                return True, copy_value(row[1])
+
+            self.counters["misses"] += 1
+            return False, None
+
+    def get_stale(self, key):
+        """Return the last stored value for key, ignoring its TTL."""
+        with self.lock:
+            entry = self.memory.get(key)
+            value = entry[1] if entry is not None else None
+            if value is None:
+                row = self._read_disk(key)
+                value = row[1] if row is not None else None
+            if value:
+                self.counters["stale_served"] += 1
+                return copy_value(value)
+            return None
+
+    def set(self, key, value):
+        ttl = self.ttl if value else self.negative_ttl
+        expires_at = time.time() + ttl
+        with self.lock:
+            self._remember(key, expires_at, value)
+            self.counters["writes"] += 1
+            if self.db is not None:
+                self.db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _count_hit(self, counter, value):
+        self.counters[counter] += 1
+        if not value:
+            self.counters["negative_hits"] += 1
+
+    def _remember(self, key, expires_at, value):
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if self.db is None:
+            return None
+        row = self.db.execute(
+            f"SELECT expires_at, value FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from allergens import allergen_report
+from nutrition import nutrition_report
+
+SUMMARY_PROMPT = """Based on this person's profile and the food item, provide a brief personalized analysis (max 100 words):
+- Is this food good for their health goals?
+- Any concerns based on their allergies or dietary preferences?
+- Brief recommendation.
+
+Use **bold** for important nutrients, allergens, or food names. Keep it friendly and concise."""
+
+ALTERNATIVES_PROMPT = """Based on the scanned food and user's profile, suggest alternatives (max 120 words):
+
+If the food is already healthy for their goals: Start with "This food is good enough, no alternatives needed. But if you want variety, try:" then list 2-3 similar healthy options.
+
+If the food is unhealthy or doesn't align with their goals: Suggest 3-4 better alternatives that match their dietary preferences and health goals.
+
+Format with **bold** food names and brief explanation why each alternative is better."""
+
+INGREDIENTS_PROMPT = """Provide detailed information about the key ingredients in this food (max 100 words):
+- List main ingredients with **bold** names
+- Brief health benefits or concerns for each
+- Note any processing or additives if applicable
+
+Format with bullet points."""
+
+# (section, whether the LLM sees the profile, prompt); the ingredients one
+# only depends on the product, so it is asked with an empty profile.
+# Allergens and calories are not in here: allergen_report and
+# nutrition_report work them out locally.
+SECTIONS = [
+    ("ai_summary", True, SUMMARY_PROMPT),
+    ("ai_alternatives", True, ALTERNATIVES_PROMPT),
+    ("enhanced_ingredients", False, INGREDIENTS_PROMPT),
+]
+
+
+def product_fallbacks(product_info):
+    return {
+        "ai_summary": None,
+        "ai_alternatives": None,
+        "enhanced_ingredients": product_info.get('important_ingredients', 'Not specified'),
+        "enhanced_allergens": product_info.get('allergens', 'None listed'),
+        "enhanced_calories": f"{product_info.get('calories', 'Not specified')} kcal per 100g",
+    }
+
+
+def answered(answer):
+    # get_response reports unexpected failures as "Error: ..." text.
+    return answer is not None and not answer.startswith("Error:")
+
+
+class ProductInsights:
+    """Generates the /product sections, starting as soon as a scan resolves.
+
+    prefetch() submits the LLM calls in the background, keyed by session and
+    by the profile and product they are about. sections() reuses that job's
+    finished or in-flight calls when the key still matches and only starts
+    fresh otherwise. A new scan in the same session cancels whatever of the
+    previous job is still queued. Prefetches run on their own small pool so
+    they never hold up a /product page that is already waiting.
+
+    With combined=True all sections come from one JSON-mode call; only the
+    sections missing from or invalid in its reply are asked for one by one.
+    """
+
+    def __init__(self, chatbot, workers=5, timeout=8.0, prefetch_workers=3, max_jobs=256, combined=True):
+        self.chatbot = chatbot
+        self.timeout = timeout
+        self.combined = combined
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="product-section")
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers,
+                                                    thread_name_prefix="product-prefetch")
+        # sid -> (key, {future: (section, ...)}), oldest first.
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"prefetched": 0, "reused": 0, "missed": 0, "cancelled": 0, "split_fallbacks": 0}
+
+    def job_key(self, personal_info, product_info):
+        payload = json.dumps([personal_info, product_info], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def ask(self, personal_info, product_info, names, deadline=None):
+        """Worker: answer a group of sections, returning {section: text or None}."""
+        prompts = {name: (with_profile, prompt) for name, with_profile, prompt in SECTIONS if name in names}
+        if len(prompts) == 1:
+            name, (with_profile, prompt) = next(iter(prompts.items()))
+            return {name: self.chatbot.get_response(personal_info if with_profile else {},
+                                                    product_info, prompt, deadline, request_class="analysis")}
+        return self.chatbot.get_sections(personal_info, product_info,
+                                         {name: prompt for name, (_, prompt) in prompts.items()}, deadline) or {}
+
+    def submit(self, executor, personal_info, product_info, names=None, deadline=None, combined=None):
+        names = tuple(name for name, _, _ in SECTIONS if names is None or name in names)
+        combined = self.combined if combined is None else combined
+        groups = [names] if combined and len(names) > 1 else [(name,) for name in names]
+        return {
+            executor.submit(self.ask, personal_info, product_info, group, deadline): group
+            for group in groups
+        }
+
+    def collect(self, futures, results, timeout):
+        """Wait for futures and fill results; returns sections a combined reply left out."""
+        missing = []
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            group = futures[future]
+            try:
+                answers = future.result()
+            except Exception as e:
+                print(f"Error generating {', '.join(group)}: {e}")
+                answers = {}
+            for name in group:
+                if answered(answers.get(name)):
+                    results[name] = answers[name]
+                elif len(group) > 1:
+                    missing.append(name)
+        for future in not_done:
+            print(f"Timed out generating {', '.join(futures[future])} after {timeout:.1f}s")
+        return missing
+
+    def unanswered(self, future, group):
+        """Sections of a finished job that need asking again: all of them if it raised."""
+        if not future.done():
+            return ()
+        if future.cancelled() or future.exception() is not None:
+            return group
+        answers = future.result()
+        return tuple(name for name in group if not answered(answers.get(name)))
+
+    def narrow(self, futures, names):
+        """futures without names, dropping futures left with nothing to answer."""
+        narrowed = {}
+        for future, group in futures.items():
+            group = tuple(name for name in group if name not in names)
+            if group:
+                narrowed[future] = group
+        return narrowed
+
+    def store(self, sid, key, futures):
+        with self.lock:
+            if self.jobs.get(sid, (None,))[0] == key:
+                self.jobs[sid] = (key, futures)
+
+    def cancel(self, futures):
+        cancelled = sum(future.cancel() for future in futures)
+        with self.lock:
+            self.counters["cancelled"] += cancelled
+
+    def prefetch(self, sid, personal_info, product_info):
+        if not personal_info or not product_info:
+            return
+
+        key = self.job_key(personal_info, product_info)
+        stale = []
+        with self.lock:
+            previous = self.jobs.get(sid)
+            if previous is not None and previous[0] == key:
+                return
+            self.jobs[sid] = (key, self.submit(self.prefetch_executor, personal_info, product_info))
+            self.jobs.move_to_end(sid)
+            self.counters["prefetched"] += 1
+            if previous is not None:
+                stale.append(previous[1])
+            while len(self.jobs) > self.max_jobs:
+                stale.append(self.jobs.popitem(last=False)[1][1])
+        for futures in stale:
+            self.cancel(futures)
+
+    def sections(self, sid, personal_info, product_info, deadline=None):
+        key = self.job_key(personal_info, product_info)
+        with self.lock:
+            job = self.jobs.get(sid)
+            reuse = job is not None and job[0] == key
+            self.counters["reused" if reuse else "missed"] += 1
+
+        if reuse:
+            futures = {}
+            for future, group in job[1].items():
+                # Still queued behind other sessions' prefetches: run it on the
+                # request pool instead of waiting for a prefetch worker.
+                if future.cancel():
+                    futures.update(self.submit(self.executor, personal_info, product_info, group, deadline))
+                    continue
+                # Finished, but some sections failed: keep the answers it has
+                # and ask again for just the others, one by one.
+                failed = self.unanswered(future, group)
+                futures.update(self.narrow({future: group}, failed))
+                if failed:
+                    futures.update(self.submit(self.executor, personal_info, product_info, failed, deadline,
+                                               combined=False))
+            self.store(sid, key, futures)
+        else:
+            if job is not None:
+                self.cancel(job[1])
+            futures = self.submit(self.executor, personal_info, product_info, deadline=deadline)
+            with self.lock:
+                self.jobs[sid] = (key, futures)
+                self.jobs.move_to_end(sid)
+
+        results = product_fallbacks(product_info)
+        # Safety information never waits on (or varies with) the LLM.
+        results["enhanced_allergens"] = allergen_report(product_info, personal_info.get("allergens", ""))
+        results["enhanced_calories"] = nutrition_report(product_info) or results["enhanced_calories"]
+
+        # One shared deadline: the page waits for the slowest section, capped at
+        # timeout and the request deadline, and anything still running keeps
+        # its fallback. So does a section skipped because Groq's circuit is
+        # open, which makes the page fail fast to the scanned fields.
+        timeout = min(self.timeout, deadline.remaining()) if deadline is not None else self.timeout
+        wait_until = time.monotonic() + timeout
+        missing = self.collect(futures, results, timeout)
+
+        # A malformed or partial combined reply: ask for just those sections
+        # separately, in parallel, with whatever time is left.
+        remaining = wait_until - time.monotonic()
+        if missing and remaining > 0:
+            print(f"Combined response missed {', '.join(missing)}; asking separately")
+            with self.lock:
+                self.counters["split_fallbacks"] += 1
+            retry = self.submit(self.executor, personal_info, product_info, missing, deadline, combined=False)
+            # Later views of this product reuse the retries too.
+            futures = self.narrow(futures, missing)
+            futures.update(retry)
+            self.store(sid, key, futures)
+            self.collect(retry, results, remaining)
+
+        return results
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, jobs=len(self.jobs))
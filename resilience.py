@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was skipped: its circuit is open or the request ran out of time."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+class Deadline:
+    """End-to-end time budget of one incoming request, shared by its upstream calls."""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def split(self, share):
+        """A sub-deadline using share of what is left, so the calls after it keep the rest."""
+        return Deadline(self.remaining() * share)
+
+    def timeout(self, cap=None):
+        """Seconds the next upstream call may take, at most cap; raises once the budget is spent."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(cap, remaining) if cap else remaining
+
+
+def deadline_timeout(deadline, cap=None):
+    return deadline.timeout(cap) if deadline is not None else cap
+
+
+class CircuitBreaker:
+    """Fail fast while an upstream is unhealthy.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    raise CircuitOpenError without touching the network. Once reset_timeout
+    has passed a single probe call is let through; its outcome closes the
+    circuit again or re-opens it for another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.counters = {"opened": 0, "rejected": 0}
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # This caller becomes the probe; everyone else keeps failing fast.
+                self.state = "half_open"
+                return
+            if self.state != "closed":
+                self.counters["rejected"] += 1
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print(f"{self.name} circuit closed")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.counters["opened"] += 1
+                print(f"{self.name} circuit opened after {self.failures} consecutive failures")
+
+    def call(self, fn, *args, **kwargs):
+        self.check()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, state=self.state, failures=self.failures)
+
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return this process's circuit breaker for an upstream, creating it on first use."""
+    with breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name)
+        return breakers[name]
+
+
+def breaker_stats():
+    with breakers_lock:
+        return {name: breaker.stats() for name, breaker in breakers.items()}
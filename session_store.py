@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class MemorySessionStore:
+    """Per-process session state. Only correct with a single worker."""
+
+    def __init__(self, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is None or entry[0] < time.time():
+                return {}
+            return json.loads(entry[1])
+
+    def save(self, sid, state):
+        with self.lock:
+            self.sessions[sid] = (time.time() + self.ttl, json.dumps(state))
+            if len(self.sessions) % 256 == 0:
+                now = time.time()
+                self.sessions = {key: entry for key, entry in self.sessions.items() if entry[0] >= now}
+
+
+class SQLiteSessionStore:
+    """Session state shared by every worker process on the host."""
+
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "sid TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.db.commit()
+        self.writes = 0
+
+    def load(self, sid):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT state FROM sessions WHERE sid = ? AND expires_at >= ?", (sid, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save(self, sid, state):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sessions (sid, state, expires_at) VALUES (?, ?, ?)",
+                (sid, json.dumps(state), time.time() + self.ttl),
+            )
+            self.writes += 1
+            if self.writes % 256 == 0:
+                self.db.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+
+
+class RedisSessionStore:
+    """Session state in Redis (or anything speaking its protocol), shared across hosts."""
+
+    def __init__(self, url, ttl=7 * 24 * 3600):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_STORE points at Redis but the 'redis' package is not installed")
+        self.ttl = int(ttl)
+        self.client = redis.Redis.from_url(url)
+
+    def load(self, sid):
+        value = self.client.get(f"kenshoku:session:{sid}")
+        return json.loads(value) if value else {}
+
+    def save(self, sid, state):
+        self.client.set(f"kenshoku:session:{sid}", json.dumps(state), ex=self.ttl)
+
+
+def create_session_store(url, ttl=7 * 24 * 3600):
+    """Build a store from SESSION_STORE: 'memory', 'sqlite:///path' or 'redis://host:port/db'."""
+    if not url or url == "memory":
+        return MemorySessionStore(ttl=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(url, ttl=ttl)
+    raise ValueError(f"Unsupported SESSION_STORE: {url}")
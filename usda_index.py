@@ -0,0 +1,188 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+# food.csv data_type -> the dataType label the FDC search API reports.
+DATA_TYPES = {
+    "survey_fndds_food": "Survey (FNDDS)",
+    "foundation_food": "Foundation",
+    "sr_legacy_food": "SR Legacy",
+}
+
+# nutrient.csv id -> the nutrientName used by the FDC search API. Energy has
+# several ids (kcal, kJ, Atwater factors); only the kcal ones are kept and
+# the first one present wins.
+NUTRIENTS = {
+    1008: "Energy",
+    2047: "Energy",
+    2048: "Energy",
+    1003: "Protein",
+    1005: "Carbohydrate, by difference",
+    1004: "Total lipid (fat)",
+    1079: "Fiber, total dietary",
+    2000: "Sugars, total including NLEA",
+    1063: "Sugars, total including NLEA",
+    1093: "Sodium, Na",
+}
+
+STOPWORDS = {"a", "an", "and", "or", "with", "in", "of", "the", "on", "nfs"}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def trigrams(tokens):
+    # Per-token padding keeps the grams independent of word order, which
+    # matters because FDC descriptions read "Chicken, breast, grilled".
+    grams = set()
+    for token in tokens:
+        padded = f"  {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class UsdaFoodIndex:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS foods ("
+            "fdc_id INTEGER PRIMARY KEY, description TEXT NOT NULL, "
+            "data_type TEXT NOT NULL, nutrients TEXT NOT NULL)"
+        )
+        self.db.commit()
+        self.load()
+
+    def load(self):
+        foods = {}
+        postings = defaultdict(list)
+        token_sets = {}
+        for fdc_id, description, data_type, nutrients in self.db.execute(
+            "SELECT fdc_id, description, data_type, nutrients FROM foods"
+        ):
+            tokens = tokenize(description)
+            grams = trigrams(tokens)
+            foods[fdc_id] = {
+                "fdcId": fdc_id,
+                "description": description,
+                "dataType": data_type,
+                "nutrients": json.loads(nutrients),
+                "gram_count": len(grams),
+            }
+            token_sets[fdc_id] = set(tokens)
+            for gram in grams:
+                postings[gram].append(fdc_id)
+
+        with self.lock:
+            self.foods = foods
+            self.postings = dict(postings)
+            self.token_sets = token_sets
+        print(f"Loaded {len(foods)} foods into the local USDA index")
+
+    def __len__(self):
+        return len(self.foods)
+
+    def search(self, query, limit=1):
+        """Return up to limit foods ranked by fuzzy similarity to query.
+
+        Scores blend the Dice coefficient over word trigrams (tolerates typos
+        and plural/word-order differences) with the share of query words that
+        appear verbatim in the description.
+        """
+        tokens = tokenize(query)
+        grams = trigrams(tokens)
+        if not grams:
+            return []
+
+        with self.lock:
+            foods, postings, token_sets = self.foods, self.postings, self.token_sets
+
+        shared = Counter()
+        for gram in grams:
+            shared.update(postings.get(gram, ()))
+
+        query_tokens = set(tokens)
+        results = []
+        for fdc_id, overlap in shared.most_common(200):
+            food = foods[fdc_id]
+            dice = 2.0 * overlap / (len(grams) + food["gram_count"])
+            coverage = len(query_tokens & token_sets[fdc_id]) / len(query_tokens)
+            results.append((round(0.5 * dice + 0.5 * coverage, 4), fdc_id))
+
+        results.sort(key=lambda item: (-item[0], foods[item[1]]["gram_count"]))
+        return [dict(foods[fdc_id], score=score) for score, fdc_id in results[:limit]]
+
+    def import_csv(self, directory):
+        """Load one FDC CSV download (Foundation, SR Legacy or FNDDS)."""
+        started = time.time()
+        foods = {}
+        with open(os.path.join(directory, "food.csv"), newline="", encoding="utf-8") as handle:
+            for row in csv.DictReader(handle):
+                data_type = DATA_TYPES.get(row.get("data_type"))
+                if data_type:
+                    foods[int(row["fdc_id"])] = (row["description"], data_type)
+
+        nutrients = defaultdict(dict)
+        priority = list(NUTRIENTS)
+        with open(os.path.join(directory, "food_nutrient.csv"), newline="", encoding="utf-8") as handle:
+            for row in csv.DictReader(handle):
+                try:
+                    fdc_id = int(row["fdc_id"])
+                    nutrient_id = int(row["nutrient_id"])
+                    amount = float(row["amount"])
+                except (KeyError, ValueError):
+                    continue
+                if fdc_id not in foods or nutrient_id not in NUTRIENTS:
+                    continue
+                name = NUTRIENTS[nutrient_id]
+                current = nutrients[fdc_id].get(name)
+                if current is None or priority.index(nutrient_id) < current[0]:
+                    nutrients[fdc_id][name] = (priority.index(nutrient_id), amount)
+
+        rows = [
+            (fdc_id, description, data_type,
+             json.dumps({name: value[1] for name, value in nutrients[fdc_id].items()}))
+            for fdc_id, (description, data_type) in foods.items()
+            if nutrients.get(fdc_id)
+        ]
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO foods (fdc_id, description, data_type, nutrients) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.db.commit()
+
+        print(f"Imported {len(rows)} foods from {directory} in {time.time() - started:.1f}s")
+        return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local USDA FoodData Central index from CSV downloads.")
+    parser.add_argument("directories", nargs="+", help="Unzipped FDC CSV downloads (Foundation, SR Legacy, FNDDS)")
+    parser.add_argument("--index", default=os.getenv("USDA_INDEX_PATH", os.path.join(os.getcwd(), "cache", "usda_foods.sqlite")))
+    args = parser.parse_args()
+
+    index = UsdaFoodIndex(args.index)
+    for directory in args.directories:
+        index.import_csv(directory)